@@ -1,15 +1,28 @@
 import logging
 import pysolr
-from config.config import SOLR_ENDPOINT, SOLR_PROFILE
+import requests
+from requests.adapters import HTTPAdapter
+from config import config
 
-def create_solr_client_cv():
+SOLR_POOL_SIZE = 16  # Keep-alive connections per Solr host, at least the number of indexing workers
+SOLR_TIMEOUT = (10, 120)  # Per-request (connect, read) timeouts in seconds
+
+def create_session(pool_size=SOLR_POOL_SIZE):
+    """HTTP session with a keep-alive connection pool that clients and worker threads can share."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def create_solr_client(url, session=None, timeout=SOLR_TIMEOUT):
     logging.info("Creating Solr client...")
-    client = pysolr.Solr(SOLR_ENDPOINT, timeout=120)
+    client = pysolr.Solr(url, timeout=timeout, session=session)
     logging.info("Solr client created.")
     return client
 
-def create_solr_client_profile():
-    logging.info("Creating Solr client...")
-    client = pysolr.Solr(SOLR_PROFILE, timeout=120)
-    logging.info("Solr client created.")
-    return client
\ No newline at end of file
+def create_solr_client_cv(session=None, timeout=SOLR_TIMEOUT):
+    return create_solr_client(config.SOLR_ENDPOINT, session, timeout)
+
+def create_solr_client_profile(session=None, timeout=SOLR_TIMEOUT):
+    return create_solr_client(config.SOLR_PROFILE, session, timeout)
@@ -10,20 +10,43 @@ def get_env_variable(key: str, default: Optional[str] = None) -> str:
         raise ValueError(f"Environment variable {key} is not set")
     return value
 
+# Settings are read from the environment on first access (PEP 562 module __getattr__),
+# so importing this module is free and a code path only needs the variables it uses.
+
 # Critical variables (no default)
 #ELASTIC_URL = get_env_variable('ELASTIC_URL')
-HUGGING_FACE_API = get_env_variable('HUGGING_FACE_API')
-OPENAI_API_KEY = get_env_variable('OPENAI_API_KEY')
-PROJ_ID = get_env_variable('PROJ_ID')
-
-
 #ELASTIC_PASSWORD = os.getenv("ELASTIC_PASSWORD")
 #ELASTIC_CA_CERTS_PATH = os.getenv("ELASTIC_CA_CERTS_PATH")
-
-ELASTIC_ENDPOINT = get_env_variable('ELASTIC_ENDPOINT')
-ELASTIC_CLOUD_ID = get_env_variable('ELASTIC_CLOUD_ID')
-ELASTIC_API_KEY = get_env_variable('ELASTIC_API_KEY')
-
-SOLR_ENDPOINT = get_env_variable('SOLR_ENDPOINT')
-
-SOLR_PROFILE = get_env_variable('SOLR_PROFILE')
\ No newline at end of file
+_REQUIRED = [
+    'HUGGING_FACE_API',
+    'OPENAI_API_KEY',
+    'PROJ_ID',
+    'ELASTIC_ENDPOINT',
+    'ELASTIC_CLOUD_ID',
+    'ELASTIC_API_KEY',
+    'SOLR_ENDPOINT',
+    'SOLR_PROFILE',
+]
+
+_DEFAULTS = {
+    # Embedding backend: "openai", or "hashing" for the offline provider used in load tests
+    'EMBEDDING_PROVIDER': 'openai',
+    'EMBEDDING_MODEL': 'text-embedding-3-large',
+    'EMBEDDING_DIMENSIONS': '1024',
+    # Embedding fields stored and indexed as int8 (BYTE) vectors: comma-separated names, "all" or empty for none
+    'QUANTIZED_FIELDS': '',
+}
+
+_TYPES = {
+    'EMBEDDING_DIMENSIONS': int,
+}
+
+def __getattr__(name: str):
+    if name in _REQUIRED:
+        value = get_env_variable(name)
+    elif name in _DEFAULTS:
+        value = _TYPES.get(name, str)(get_env_variable(name, _DEFAULTS[name]))
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value  # Later lookups no longer reach __getattr__
+    return value
@@ -1,17 +1,303 @@
 import json
 import os
+import re
+import hashlib
+import time
+import random
+import logging
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+import pysolr
+import requests
+from processing.vector_store import VectorStore, vector_dir_for
 
-def index_documents(client, data_directory):
-    for filename in os.listdir(data_directory):
-        if filename.endswith('.json'):
+INDEX_BATCH_SIZE = 500  # Documents per update request
+INDEX_BATCH_BYTES = 32 * 2**20  # Approximate request body limit, well under Solr's default 2 GB upload limit
+COMMIT_WITHIN = None  # Milliseconds for Solr to commit on its own, None for one commit after the last batch
+INDEX_WORKERS = 4  # Update requests in flight at once, keep within the client's connection pool size
+INDEX_MAX_RETRIES = 10  # Retries of a batch that Solr rejects with back-pressure (HTTP 429/503)
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+BACKPRESSURE_STATUSES = (429, 503)
+INDEX_STATE_FILE = "index_state.json"  # Content hash of every indexed document, kept in the data directory
+STREAM_CHUNK_BYTES = 1 << 20  # Compressed body chunk size of streamed requests
+
+def load_vector_store(data_directory):
+    """Open the vector sidecar of a directory of embedded documents, if it has one."""
+    vector_dir = vector_dir_for(data_directory)
+    if os.path.exists(os.path.join(vector_dir, "meta.json")):
+        return VectorStore(vector_dir)
+    return None
+
+def serialize_document(content, document_id, vectors):
+    """
+    JSON line of a document for Solr's JSON update handler, built by splicing the id and the
+    sidecar vectors into the document's JSON text instead of parsing and re-encoding it.
+    """
+    body = content.rstrip()
+    if not body.endswith('}'):
+        raise ValueError(f"Document {document_id} is not a JSON object")
+    fields = [f'"id": {json.dumps(document_id)}']
+    fields.extend(f'{json.dumps(field)}: {json.dumps(vector.tolist())}' for field, vector in vectors.items())
+    # Raw newlines only occur between tokens in JSON, so the document fits on one line
+    head = body[:-1].rstrip().replace("\n", " ")
+    separator = ", " if head != "{" else ""
+    return f"{head}{separator}{', '.join(fields)}}}\n".encode('utf-8')
+
+def iter_documents(data_directory, store=None, indexed=None, serialized=False):
+    """
+    Yield (filename, document_id, document, approximate JSON size in bytes, content hash) for
+    every JSON file of a directory. The hash covers the JSON and the document's vectors; documents
+    whose hash matches indexed (document_id -> hash) are yielded without the document (None).
+    With serialized=True the document is its JSON line (serialize_document) and the JSON is not
+    parsed; its document_id is then taken from the filename, as the parsing stage names files.
+    """
+    indexed = indexed or {}
+    for filename in sorted(os.listdir(data_directory)):
+        if filename.endswith('.json') and filename != INDEX_STATE_FILE:
             file_path = os.path.join(data_directory, filename)
-            print(f"Indexing file: {filename}")  # Print the name of the file being indexed
             with open(file_path, 'r') as f:
                 content = f.read()
+            if serialized:
+                doc = None
+                document_id = os.path.splitext(filename)[0]
+            else:
                 doc = json.loads(content)  # Parse the JSON content
-                client.add([doc])  # Add the document to Solr
+                document_id = doc.setdefault('document_id', os.path.splitext(filename)[0])
+                # Solr's uniqueKey, so a changed document replaces its previous version
+                doc['id'] = document_id
+            digest = hashlib.sha256(content.encode('utf-8'))
+            # Vectors are read from the memory-mapped sidecar, not from the JSON
+            vectors = store.get(document_id) if store is not None else {}
+            for field in sorted(vectors):
+                digest.update(field.encode('utf-8'))
+                digest.update(vectors[field].tobytes())
+            content_hash = digest.hexdigest()
+            if indexed.get(document_id) == content_hash:
+                yield filename, document_id, None, 0, content_hash
+                continue
+            if serialized:
+                doc = serialize_document(content, document_id, vectors)
+                yield filename, document_id, doc, len(doc), content_hash
+                continue
+            size = len(content)
+            for field, vector in vectors.items():
+                doc[field] = vector.tolist()
+                size += vector.size * (5 if vector.dtype.kind == 'i' else 22)  # Characters per component
+            yield filename, document_id, doc, size, content_hash
+
+def document_batches(documents, batch_size=INDEX_BATCH_SIZE, batch_bytes=INDEX_BATCH_BYTES):
+    """Group (filename, document_id, document, size, ...) items into lists bounded by count and total size."""
+    batch = []
+    total = 0
+    for item in documents:
+        if batch and (len(batch) >= batch_size or total + item[3] > batch_bytes):
+            yield batch
+            batch = []
+            total = 0
+        batch.append(item)
+        total += item[3]
+    if batch:
+        yield batch
+
+class Throttle:
+    """Back-off shared by all indexing workers.
+
+    When Solr answers 429 or 503, every worker pauses until the back-off
+    delay has passed; the delay doubles with each further rejection and
+    halves again with each accepted request.
+    """
+
+    def __init__(self, base_delay=BACKOFF_BASE, max_delay=BACKOFF_MAX):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.delay = 0.0
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            pause = self._resume_at - time.time()
+        if pause > 0:
+            time.sleep(pause)
+
+    def slow_down(self):
+        with self._lock:
+            self.delay = min(self.max_delay, max(self.base_delay, self.delay * 2))
+            self._resume_at = max(self._resume_at, time.time() + self.delay * random.uniform(0.5, 1.0))
+            return self.delay
+
+    def recover(self):
+        with self._lock:
+            self.delay = self.delay / 2 if self.delay > self.base_delay else 0.0
+
+def _status(error):
+    match = re.search(r"\(HTTP (\d{3})\)", str(error))
+    return int(match.group(1)) if match else None
+
+def add_documents(client, docs, commit_within=COMMIT_WITHIN):
+    """Send document dicts in one update request through pysolr."""
+    client.add(docs, commit=False, commitWithin=commit_within)
+
+def _gzip_chunks(chunks, chunk_bytes=STREAM_CHUNK_BYTES):
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        buffer.append(compressor.compress(chunk))
+        size += len(buffer[-1])
+        if size >= chunk_bytes:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+    buffer.append(compressor.flush())
+    yield b"".join(buffer)
+
+def post_documents(client, docs, commit_within=COMMIT_WITHIN, compress=False):
+    """
+    Stream JSON lines (serialize_document) to the collection's /update/json/docs handler as one
+    chunked request body, gzip-compressed with compress=True (Solr's Jetty must accept gzip
+    request bodies). Errors are raised as pysolr.SolrError like pysolr's own requests.
+    """
+    params = {"commitWithin": int(commit_within)} if commit_within is not None else {}
+    headers = {"Content-Type": "application/json"}
+    body = iter(docs)  # A generator body is sent with chunked transfer encoding
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+        body = _gzip_chunks(body)
+    try:
+        response = client.get_session().post(f"{client.url.rstrip('/')}/update/json/docs", params=params,
+                                             data=body, headers=headers, timeout=client.timeout)
+    except requests.exceptions.RequestException as e:
+        raise pysolr.SolrError(f"Failed to stream documents to {client.url}: {e}")
+    if response.status_code != 200:
+        raise pysolr.SolrError(f"Solr responded with an error (HTTP {response.status_code}): {response.text[:500]}")
+
+def add_batch(client, docs, throttle, commit_within=COMMIT_WITHIN, max_retries=INDEX_MAX_RETRIES, send=add_documents):
+    """Send one update request, waiting out Solr back-pressure instead of failing."""
+    for attempt in range(max_retries + 1):
+        throttle.wait()
+        try:
+            send(client, docs, commit_within)
+        except pysolr.SolrError as e:
+            status = _status(e)
+            if status not in BACKPRESSURE_STATUSES or attempt == max_retries:
+                raise
+            delay = throttle.slow_down()
+            logging.warning(f"Solr answered HTTP {status}, retry {attempt + 1}/{max_retries} with all workers paused ~{delay:.1f}s")
+            continue
+        throttle.recover()
+        return len(docs)
+
+def load_index_state(data_directory, collection):
+    """document_id -> content hash of what was last indexed from a directory into a collection."""
+    state_path = os.path.join(data_directory, INDEX_STATE_FILE)
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, 'r') as f:
+        state = json.load(f)
+    if state.get("collection") != collection:
+        print(f"Index state of {data_directory} belongs to {state.get('collection')}, not {collection}")
+        return None
+    return state["documents"]
+
+def save_index_state(data_directory, collection, documents):
+    state_path = os.path.join(data_directory, INDEX_STATE_FILE)
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({"collection": collection, "documents": documents}, f)
+    os.replace(tmp_path, state_path)
+
+def index_documents(client, data_directory, batch_size=INDEX_BATCH_SIZE, batch_bytes=INDEX_BATCH_BYTES,
+                    commit_within=COMMIT_WITHIN, workers=INDEX_WORKERS, full=False, stream=False, compress=False):
+    """
+    Bring a collection in line with a directory of documents, sending only what changed.
+
+    A content hash of every indexed document is kept in <data_directory>/index_state.json.
+    New and changed documents are added (replacing the previous version by id), unchanged
+    ones are skipped and documents whose file disappeared are deleted. Without a state for
+    this collection, or with full=True, the collection is cleared and rebuilt once.
+
+    Documents are sent in bulk update requests of up to batch_size documents or batch_bytes
+    of JSON, without committing per request. With commit_within set, Solr commits on its own
+    within that many milliseconds; otherwise one commit follows the last request.
+    Up to workers requests run concurrently over the client's session, so give the client a
+    pooled session (clients.solr.create_session) with at least that many connections.
+    At most workers + 1 batches, each up to batch_bytes, are held in memory.
+
+    With stream=True documents are not parsed and re-encoded: their JSON text is spliced with
+    the vectors and streamed to /update/json/docs (post_documents), gzip-compressed with
+    compress=True.
+    """
+    collection = client.url
+    previous = None if full else load_index_state(data_directory, collection)
+    if previous is None:
+        delete_index(client)
+        previous = {}
+    current = {}  # Hashes of documents sent or found unchanged in this run
+    seen = set()
+
+    store = load_vector_store(data_directory)
+    throttle = Throttle()
+    start = time.time()
+    indexed = 0
+    unchanged = 0
+
+    def changed_documents():
+        nonlocal unchanged
+        for item in iter_documents(data_directory, store, previous, serialized=stream):
+            _, document_id, doc, _, content_hash = item
+            seen.add(document_id)
+            if doc is None:
+                current[document_id] = content_hash
+                unchanged += 1
+            else:
+                yield item
+
+    def record(future, batch):
+        future.result()
+        current.update((document_id, content_hash) for _, document_id, _, _, content_hash in batch)
+        return len(batch)
+
+    send = partial(post_documents, compress=compress) if stream else add_documents
+    deleted = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            pending = {}
+            for batch in document_batches(changed_documents(), batch_size, batch_bytes):
+                # At most one batch per worker is in flight and only the next one is read ahead,
+                # so at most (workers + 1) batches are held in memory
+                if len(pending) >= max(1, workers):
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        indexed += record(future, pending.pop(future))
+                    print(f"Indexed {indexed} documents ({batch[-1][0]})")
+                docs = [doc for _, _, doc, _, _ in batch]
+                pending[pool.submit(add_batch, client, docs, throttle, commit_within, send=send)] = batch
+            for future, batch in pending.items():
+                indexed += record(future, batch)
+
+        removed = [document_id for document_id in previous if document_id not in seen]
+        for i in range(0, len(removed), batch_size):
+            client.delete(id=removed[i:i + batch_size], commit=False)
+            deleted.extend(removed[i:i + batch_size])
+        if (indexed or deleted) and commit_within is None:
+            client.commit()
+    finally:
+        # Documents not sent or deleted (e.g. after an error) keep their previous hash and are retried next run
+        deleted = set(deleted)
+        state = {document_id: content_hash for document_id, content_hash in previous.items()
+                 if document_id not in deleted}
+        state.update(current)
+        save_index_state(data_directory, collection, state)
+    elapsed = time.time() - start
+    print(f"Indexed {indexed} documents from {data_directory} in {elapsed:.1f}s "
+          f"({indexed / max(elapsed, 1e-9):.0f} docs/s), {unchanged} unchanged, {len(deleted)} deleted")
+    return indexed
 
 def delete_index(client):
     # Solr does not support deleting an index directly, you can delete all documents instead
     client.delete(q='*:*')
-    print(f"Deleted all documents in collection: {client}")
\ No newline at end of file
+    print(f"Deleted all documents in collection: {client}")
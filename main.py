@@ -1,76 +1,124 @@
 import os
-import pandas as pd
-import json
-import datetime
-from processing.extract import process_files, get_base_filenames
-from processing.parse_cv import process_cvs
-from processing.calculate_embeddings import embed_json_files
-from clients.solr import create_solr_client_cv, create_solr_client_profile
-from indexing import index_documents, delete_index
+import sys
 
+# Each stage imports its own modules, so running one stage does not load the others' dependencies
+# (LangChain, the OpenAI SDK, pysolr)
+STAGES = ["extract", "parse", "embed", "index"]
 
-def main():
+cv_dir = "data/dataset/CV"
+cv_corpus = "data/extracted/cv.parquet"
+profile_dir = "data/dataset/PROFILE"
+profile_corpus = "data/extracted/profile.parquet"
+
+# BATCH_MODE=1 sends parsing and embedding through the asynchronous batch API instead of live requests
+batch_mode = os.getenv("BATCH_MODE", "0") == "1"
+
+
+def extract():
+    from processing.extract import process_files, get_base_filenames
+    from processing.dedup import find_near_duplicates, clusters_path_for
+    from processing.corpus import prune_outputs
 
     # Process CV dataset (PDF, DOC, DOCX)
-    cv_dir = "data/dataset/CV"
-    cv_output_csv = "data/extracted/cv.csv"
-    if not os.path.exists(cv_output_csv):
-        process_files(cv_dir, cv_output_csv, file_types=['pdf', 'doc', 'docx'])
-    else:
-        print(f"{cv_output_csv} already exists. Skipping processing.")
+    extract_workers = os.cpu_count()  # Number of extraction processes, 1 disables the pool
+    pdf_limits = {"pdf_max_pages": 10, "pdf_max_chars": 50000}  # The parsing prompt only needs the first pages
+    # Extraction is incremental: only new or changed files are re-extracted
+    process_files(cv_dir, cv_corpus, file_types=['pdf', 'doc', 'docx'], workers=extract_workers, **pdf_limits)
 
     # Get base filenames from CV directory
     cv_base_filenames = get_base_filenames(cv_dir, '-CV')
     print(f"Found {len(cv_base_filenames)} base filenames in CV directory.")
 
     # Process PROFILE dataset (PDF, DOC, DOCX)
-    profile_dir = "data/dataset/PROFILE"
-    profile_output_csv = "data/extracted/profile.csv"
-    if not os.path.exists(profile_output_csv):
-        process_files(profile_dir, profile_output_csv, file_types=['pdf', 'doc', 'docx'], filter_set=cv_base_filenames)
-    else:
-        print(f"{profile_output_csv} already exists. Skipping processing.")
+    process_files(profile_dir, profile_corpus, file_types=['pdf', 'doc', 'docx'], filter_set=cv_base_filenames, workers=extract_workers, **pdf_limits)
+
+    # Cluster near-duplicate documents so each cluster is parsed and embedded once
+    find_near_duplicates(cv_corpus, output_path=clusters_path_for(cv_corpus))
+    find_near_duplicates(profile_corpus, output_path=clusters_path_for(profile_corpus))
+
+    # Outputs of files deleted from the datasets are removed, so indexing deletes them from Solr
+    for corpus, name in ((cv_corpus, "cv"), (profile_corpus, "profile")):
+        prune_outputs(corpus, f"data/parsed_data/{name}")
+        # index_state.json is the indexer's state (indexing.INDEX_STATE_FILE), not a document
+        prune_outputs(corpus, f"data/parsed_data_embeddings/{name}", keep=("index_state.json",))
 
-    csv_path = "data/extracted/cv.csv"
-    batch_size = 1000  # You can adjust the batch size as needed
-    process_cvs(csv_path, "data/parsed_data/cv", batch_size)
 
-    csv_path = "data/extracted/profile.csv"
-    batch_size = 1000  # You can adjust the batch size as needed
-    process_cvs(csv_path, "data/parsed_data/profile", batch_size)
+def parse():
+    from processing.dedup import clusters_path_for
+    cv_clusters = clusters_path_for(cv_corpus)
+    profile_clusters = clusters_path_for(profile_corpus)
+
+    if batch_mode:
+        from processing.batch_jobs import parse_cvs_batch
+        parse_cvs_batch(cv_corpus, "data/parsed_data/cv", clusters_path=cv_clusters)
+        parse_cvs_batch(profile_corpus, "data/parsed_data/profile", clusters_path=profile_clusters)
+    else:
+        from processing.parse_cv import process_cvs
+        batch_size = 1000  # You can adjust the batch size as needed
+        max_concurrency = 16  # Parsing requests in flight, keep within the API rate limit
+        # Run several copies with SHARD_INDEX=0..SHARD_COUNT-1 to split parsing between processes or machines
+        shard = {"shard_index": int(os.getenv("SHARD_INDEX", "0")), "shard_count": int(os.getenv("SHARD_COUNT", "1"))}
+        process_cvs(cv_corpus, "data/parsed_data/cv", batch_size, clusters_path=cv_clusters, max_concurrency=max_concurrency,
+                    full_corpus=True, **shard)
+
+        batch_size = 1000  # You can adjust the batch size as needed
+        process_cvs(profile_corpus, "data/parsed_data/profile", batch_size, clusters_path=profile_clusters, max_concurrency=max_concurrency,
+                    full_corpus=True, **shard)
+
+
+def embed():
+    from processing.dedup import clusters_path_for
+    if batch_mode:
+        from processing.batch_jobs import embed_json_files_batch as embed_json_files
+    else:
+        from processing.calculate_embeddings import embed_json_files
+
+    # Calculate embeddings for CV and Profile documents
+    embed_json_files('data/parsed_data/cv', 'data/parsed_data_embeddings/cv', clusters_path=clusters_path_for(cv_corpus))
+    embed_json_files('data/parsed_data/profile', 'data/parsed_data_embeddings/profile', clusters_path=clusters_path_for(profile_corpus))
 
-    # Calculate embeddings for CV documents
-    input_directory = 'data/parsed_data/cv'
-    output_directory = 'data/parsed_data_embeddings/cv'
-    embed_json_files(input_directory, output_directory)
 
-    # Calculate embeddings for Profile documents
-    input_directory = 'data/parsed_data/profile'
-    output_directory = 'data/parsed_data_embeddings/profile'
-    embed_json_files(input_directory, output_directory)
+def index():
+    from clients.solr import create_session, create_solr_client_cv, create_solr_client_profile
+    from indexing import index_documents
 
-    client_cv = create_solr_client_cv()
+    # Both collections share one keep-alive connection pool, used by all indexing workers
+    session = create_session()
+    client_cv = create_solr_client_cv(session)
     print(client_cv.ping())
 
-    client_profile = create_solr_client_profile()
+    client_profile = create_solr_client_profile(session)
     print(client_profile.ping())
-    
-    print("--------------------------DELETING COLLECTION-------------------------")
-    delete_index(client_cv)
-    delete_index(client_profile)
 
     print("--------------------------INDEXING DOCUMENTS-------------------------")
 
+    # Only new, changed and removed documents are sent; FULL_REINDEX=1 clears and rebuilds the collections
+    full = os.getenv("FULL_REINDEX", "0") == "1"
+    # STREAM_INDEX=1 streams the JSON files to /update/json/docs without parsing them, STREAM_INDEX=gzip also compresses
+    stream_index = os.getenv("STREAM_INDEX", "0")
+    options = {"full": full, "stream": stream_index in ("1", "gzip"), "compress": stream_index == "gzip"}
+
     # Index CV documents
     data_directory = "data/parsed_data_embeddings/cv"
-    index_documents(client_cv, data_directory)
+    index_documents(client_cv, data_directory, **options)
 
     # Index Profile documents
     data_directory = "data/parsed_data_embeddings/profile"
-    index_documents(client_profile, data_directory)
+    index_documents(client_profile, data_directory, **options)
 
     print("---------------------------Indexing complete--------------------------")
 
 
+def main(stages=None):
+    # python main.py [extract] [parse] [embed] [index]; all stages run in order by default
+    stages = stages or STAGES
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        raise SystemExit(f"Unknown stage(s): {', '.join(unknown)} (choose from {', '.join(STAGES)})")
+    for stage in STAGES:
+        if stage in stages:
+            globals()[stage]()
+
+
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import logging
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Type
+import openai
+from openai import OpenAI
+from pydantic import BaseModel
+from config import config
+from config.logging_config import setup_logging
+from processing.corpus import read_corpus
+from processing.dedup import load_clusters, fan_out
+from processing.parse_cv import (MODEL_NAME, PROMPT_MODE, MAX_CV_CHARS, RULE_FIELDS, build_extraction_prompt,
+                                 get_parse_cache, prompt_version, schema_version, token_usage)
+from processing.parse_cache import parse_cache_key
+from processing.rule_fields import extract_rule_fields, response_model_without, merge_rule_fields, estimate_tokens_saved
+from processing.calculate_embeddings import (FIELDS_TO_EMBED, EMBEDDING_DIMENSIONS, open_vector_store,
+                                            save_embedded_documents)
+
+BATCH_WORK_DIR = "data/batch_jobs"
+MAX_REQUESTS_PER_BATCH = 50000  # Input file limits of the OpenAI batch API: 50,000 requests and 200 MB
+MAX_BYTES_PER_BATCH = 190 * 2**20
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+_ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+def get_batch_client(base_url: Optional[str] = None) -> OpenAI:
+    """Client for the batch API.
+
+    ``base_url`` (or the ``OPENAI_BASE_URL`` environment variable) points it at
+    an OpenAI-compatible stand-in, e.g. a local mock server for testing.
+    """
+    return OpenAI(api_key=config.OPENAI_API_KEY, base_url=base_url or os.getenv("OPENAI_BASE_URL"))
+
+@lru_cache(maxsize=None)
+def _response_tool(schema: Type[BaseModel]) -> dict:
+    return openai.pydantic_function_tool(schema)
+
+def parse_request(filename: str, cv_text: str, prompt_mode: str = PROMPT_MODE, use_rule_fields: bool = RULE_FIELDS) -> dict:
+    """Batch request line asking the chat model for a ``ResponseFormatter`` tool call.
+
+    With ``use_rule_fields`` the fields found by regex are left out of the
+    requested schema, as in ``parse_cv``.
+    """
+    rule_fields = extract_rule_fields(cv_text) if use_rule_fields else {}
+    schema = response_model_without(frozenset(rule_fields))
+    messages = build_extraction_prompt(cv_text, prompt_mode, MAX_CV_CHARS, schema).format_messages()
+    return {
+        "custom_id": filename,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": MODEL_NAME,
+            "temperature": 0,
+            "messages": [{"role": _ROLES[message.type], "content": message.content} for message in messages],
+            "tools": [_response_tool(schema)],
+            "tool_choice": {"type": "function", "function": {"name": "ResponseFormatter"}},
+        },
+    }
+
+def embedding_request(filename: str, texts: List[str]) -> dict:
+    """Batch request line embedding all field texts of one document in a single call."""
+    return {
+        "custom_id": filename,
+        "method": "POST",
+        "url": "/v1/embeddings",
+        "body": {"model": config.EMBEDDING_MODEL, "input": texts, "dimensions": EMBEDDING_DIMENSIONS},
+    }
+
+def write_request_files(requests: Iterator[dict], prefix: str, max_requests: int = MAX_REQUESTS_PER_BATCH,
+                        max_bytes: int = MAX_BYTES_PER_BATCH) -> List[str]:
+    """Write request lines to ``<prefix>_<n>.jsonl`` files of at most ``max_requests`` lines and ``max_bytes`` each."""
+    os.makedirs(os.path.dirname(prefix) or ".", exist_ok=True)
+    paths = []
+    f = None
+    count = 0
+    size = 0
+    for request in requests:
+        line = (json.dumps(request) + "\n").encode('utf-8')
+        if f is None or count >= max_requests or size + len(line) > max_bytes:
+            if f is not None:
+                f.close()
+            path = f"{prefix}_{int(time.time())}_{len(paths)}.jsonl"
+            paths.append(path)
+            f = open(path, 'wb')
+            count = 0
+            size = 0
+        f.write(line)
+        count += 1
+        size += len(line)
+    if f is not None:
+        f.close()
+    return paths
+
+def submit_batch(client: OpenAI, request_path: str, endpoint: str) -> str:
+    """Upload a request file and start a batch job; the job id is saved next to the file."""
+    with open(request_path, 'rb') as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=input_file.id, endpoint=endpoint, completion_window="24h")
+    with open(f"{request_path}.batch.json", 'w') as f:
+        json.dump({"batch_id": batch.id, "input_file_id": input_file.id, "endpoint": endpoint}, f)
+    logging.info(f"Submitted batch {batch.id} for {request_path}")
+    return batch.id
+
+def wait_for_batch(client: OpenAI, batch_id: str, poll_interval: float = 30):
+    """Poll a batch job until it reaches a terminal status and return it."""
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        if counts is not None:
+            logging.info(f"Batch {batch_id} is {batch.status}: {counts.completed}/{counts.total} done, {counts.failed} failed")
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+        time.sleep(poll_interval)
+
+def iter_batch_results(client: OpenAI, batch) -> Iterator[dict]:
+    """Stream the result lines of a finished batch, errors included, without loading whole files."""
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        with client.files.with_streaming_response.content(file_id) as response:
+            for line in response.iter_lines():
+                if line.strip():
+                    yield json.loads(line)
+
+def _pending_request_files(prefix: str) -> List[str]:
+    directory, name = os.path.split(prefix)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, entry) for entry in os.listdir(directory)
+                  if entry.startswith(f"{name}_") and entry.endswith(".jsonl"))
+
+def _run_request_files(client: OpenAI, prefix: str, endpoint: str, poll_interval: float, handle_result) -> Dict[str, int]:
+    """Submit (or resume) every request file under ``prefix`` and hand each result line to ``handle_result``.
+
+    Request files and their job state are deleted once all of their results
+    were handled, so an interrupted run picks up the unfinished jobs.
+    """
+    stats = {"succeeded": 0, "failed": 0}
+    for request_path in _pending_request_files(prefix):
+        state_path = f"{request_path}.batch.json"
+        if os.path.exists(state_path):
+            with open(state_path, 'r') as f:
+                batch_id = json.load(f)["batch_id"]
+            logging.info(f"Resuming batch {batch_id} for {request_path}")
+        else:
+            batch_id = submit_batch(client, request_path, endpoint)
+
+        batch = wait_for_batch(client, batch_id, poll_interval)
+        if batch.status != "completed":
+            logging.error(f"Batch {batch_id} ended as {batch.status}; its requests will be rebuilt on the next run")
+        for result in iter_batch_results(client, batch):
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                logging.error(f"Batch request {result.get('custom_id')} failed: {result.get('error') or response.get('body')}")
+                stats["failed"] += 1
+                continue
+            try:
+                handle_result(result["custom_id"], response["body"])
+                stats["succeeded"] += 1
+            except Exception as e:
+                logging.error(f"Error handling batch result for {result.get('custom_id')}: {e}")
+                stats["failed"] += 1
+        os.remove(request_path)
+        os.remove(state_path)
+    return stats
+
+def parse_cvs_batch(corpus_path: str, output_dir: str, clusters_path: Optional[str] = None,
+                    prompt_mode: str = PROMPT_MODE, work_dir: str = BATCH_WORK_DIR, poll_interval: float = 30,
+                    base_url: Optional[str] = None) -> Dict[str, int]:
+    """Parse every unparsed CV of a corpus through one or more asynchronous batch jobs.
+
+    CVs that already have output, that are near duplicates or that are in the
+    parse cache never reach the batch. Results are streamed into
+    ``output_dir`` like ``process_cvs`` writes them.
+    """
+    setup_logging('cv_parsing_batch')
+    client = get_batch_client(base_url)
+    os.makedirs(output_dir, exist_ok=True)
+    prefix = os.path.join(work_dir, f"parse_{os.path.basename(os.path.normpath(output_dir))}")
+
+    df = read_corpus(corpus_path, columns=["filename", "preprocessed_text"])
+    texts = dict(zip(df["filename"], df["preprocessed_text"].fillna("")))
+    clusters = load_clusters(clusters_path)
+    duplicates = {member for members in clusters.values() for member in members}
+    cache = get_parse_cache()
+    version = prompt_version(prompt_mode, MAX_CV_CHARS)
+
+    def save(filename: str, parsed_data: dict):
+        document_id = os.path.splitext(filename)[0]
+        parsed_data = dict(parsed_data, document_id=document_id)
+        with open(os.path.join(output_dir, f"{document_id}.json"), 'w') as f:
+            json.dump(parsed_data, f, indent=2)
+        if filename in clusters:
+            fan_out(parsed_data, clusters[filename], output_dir)
+
+    def handle_result(filename: str, body: dict):
+        arguments = body["choices"][0]["message"]["tool_calls"][0]["function"]["arguments"]
+        # The rule fields are recomputed from the text, they are deterministic
+        rule_fields = extract_rule_fields(texts.get(filename, "")) if RULE_FIELDS else {}
+        parsed_data = merge_rule_fields(json.loads(arguments), rule_fields)
+        usage = body.get("usage") or {}
+        token_usage.record(filename, prompt_mode, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0),
+                           len(rule_fields), estimate_tokens_saved(rule_fields))
+        if filename in texts:
+            cache.put(parse_cache_key(texts[filename], version, MODEL_NAME, schema_version()),
+                      parsed_data, texts[filename], version, MODEL_NAME, schema_version())
+        save(filename, parsed_data)
+
+    # Jobs left over from an interrupted run are collected before anything new is submitted
+    stats = _run_request_files(client, prefix, "/v1/chat/completions", poll_interval, handle_result)
+
+    cached = 0
+    def requests():
+        nonlocal cached
+        for filename, text in texts.items():
+            if filename in duplicates:
+                continue
+            if os.path.exists(os.path.join(output_dir, f"{os.path.splitext(filename)[0]}.json")):
+                continue
+            parsed_data = cache.get(parse_cache_key(text, version, MODEL_NAME, schema_version()))
+            if parsed_data is not None:
+                save(filename, parsed_data)
+                cached += 1
+                continue
+            yield parse_request(filename, text, prompt_mode)
+
+    request_files = write_request_files(requests(), prefix)
+    logging.info(f"Wrote {len(request_files)} batch request files; {cached} CVs came from the parse cache")
+    new_stats = _run_request_files(client, prefix, "/v1/chat/completions", poll_interval, handle_result)
+    stats = {key: stats[key] + new_stats[key] for key in stats}
+    stats["cached"] = cached
+
+    usage_records = token_usage.drain()
+    if usage_records:
+        with open(os.path.join(output_dir, "token_usage.jsonl"), 'a') as f:
+            for record in usage_records:
+                f.write(json.dumps(record) + "\n")
+    logging.info(f"Batch parsing finished: {stats}")
+    return stats
+
+def embed_json_files_batch(input_dir: str, output_dir: str, clusters_path: Optional[str] = None,
+                           work_dir: str = BATCH_WORK_DIR, poll_interval: float = 30,
+                           base_url: Optional[str] = None) -> Dict[str, int]:
+    """Embed parsed CVs through asynchronous batch jobs, one request per document.
+
+    Output matches ``embed_json_files``: slim JSON documents plus their
+    ``<field>_embedding`` vectors in the ``<output_dir>/vectors`` sidecar.
+    """
+    setup_logging('embeddings_calculation_batch')
+    if config.EMBEDDING_PROVIDER != "openai":
+        raise ValueError(f"Batch embedding needs the openai provider, not {config.EMBEDDING_PROVIDER}")
+    client = get_batch_client(base_url)
+    os.makedirs(output_dir, exist_ok=True)
+    prefix = os.path.join(work_dir, f"embed_{os.path.basename(os.path.normpath(output_dir))}")
+    store = open_vector_store(output_dir)
+
+    clusters = {f"{os.path.splitext(representative)[0]}.json": members
+                for representative, members in load_clusters(clusters_path).items()}
+    duplicates = {f"{os.path.splitext(member)[0]}.json" for members in clusters.values() for member in members}
+
+    def load(filename: str) -> dict:
+        with open(os.path.join(input_dir, filename), 'r') as f:
+            return json.load(f)
+
+    def fields_of(data: dict) -> List[str]:
+        return [field for field in FIELDS_TO_EMBED if isinstance(data.get(field), str)]
+
+    def save(filename: str, data: dict):
+        save_embedded_documents([(filename, data)], output_dir, store, clusters)
+
+    def handle_result(filename: str, body: dict):
+        data = load(filename)
+        vectors = [item["embedding"] for item in sorted(body["data"], key=lambda item: item["index"])]
+        for field, vector in zip(fields_of(data), vectors):
+            data[f"{field}_embedding"] = vector
+        save(filename, data)
+
+    stats = _run_request_files(client, prefix, "/v1/embeddings", poll_interval, handle_result)
+
+    def requests():
+        for filename in sorted(os.listdir(input_dir)):
+            if not filename.endswith('.json') or filename in duplicates:
+                continue
+            if os.path.exists(os.path.join(output_dir, filename)):
+                continue
+            data = load(filename)
+            texts = [data[field] for field in fields_of(data)]
+            if not texts:
+                save(filename, data)
+                continue
+            yield embedding_request(filename, texts)
+
+    request_files = write_request_files(requests(), prefix)
+    logging.info(f"Wrote {len(request_files)} embedding batch request files")
+    new_stats = _run_request_files(client, prefix, "/v1/embeddings", poll_interval, handle_result)
+    stats = {key: stats[key] + new_stats[key] for key in stats}
+    logging.info(f"Batch embedding finished: {stats}")
+    return stats
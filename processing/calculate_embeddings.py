@@ -1,39 +1,156 @@
 import os
 import json
 import logging
+from functools import lru_cache
 from tqdm import tqdm
 from config.logging_config import setup_logging  
-from langchain_openai import OpenAIEmbeddings
-from config.config import OPENAI_API_KEY
+from config import config
+from config.config import EMBEDDING_DIMENSIONS
+from processing.dedup import load_clusters, fan_out
+from processing.embedding_cache import EmbeddingCache
+from processing.embedding_providers import get_embedding_provider
+from processing.vector_store import VectorStore, vector_dir_for
+from processing.embedding_executor import EMBEDDING_WORKERS, RetryQueue, embed_concurrently
 
-# Initialize OpenAI embeddings
-embeddings_model = OpenAIEmbeddings(model="text-embedding-3-large", openai_api_key=OPENAI_API_KEY, dimensions=1024)
+# Texts per embeddings request; the API accepts up to 2048 inputs and 300k tokens per request
+EMBEDDING_BATCH_SIZE = 512
+EMBEDDING_BATCH_CHARS = 600000  # Roughly 150k tokens, half the per-request token limit
+DOCUMENTS_PER_BATCH = 500  # Documents whose field texts are collected before embedding
+
+# Fields that get a "<field>_embedding" vector
+FIELDS_TO_EMBED = [
+    'contact_information_address',
+    'education_degrees',
+    'education_field_of_study',
+    'education_descriptions',
+    'work_experience_job_titles',
+    'work_experience_industry',
+    'work_experience_locations',
+    'work_experience_descriptions',
+    'skills',
+]
+
+@lru_cache(maxsize=1)
+def get_embeddings_model():
+    """Build the embedding provider selected in config (OpenAI by default) on first use."""
+    return get_embedding_provider()
+
+@lru_cache(maxsize=1)
+def get_embedding_cache():
+    embeddings_model = get_embeddings_model()
+    return EmbeddingCache(embeddings_model.name, embeddings_model.dimensions)
+
+def quantized_fields():
+    """Vector store fields (``<field>_embedding``) selected by the ``QUANTIZED_FIELDS`` setting."""
+    if config.QUANTIZED_FIELDS.strip() == "all":
+        return [f"{field}_embedding" for field in FIELDS_TO_EMBED]
+    names = [name.strip() for name in config.QUANTIZED_FIELDS.split(",") if name.strip()]
+    return [name if name.endswith("_embedding") else f"{name}_embedding" for name in names]
+
+def open_vector_store(output_dir):
+    """Open or create the vector sidecar of an embeddings output directory."""
+    return VectorStore(vector_dir_for(output_dir), EMBEDDING_DIMENSIONS, quantized_fields=quantized_fields())
+
+def _embed_uncached(texts, workers=EMBEDDING_WORKERS):
+    return embed_concurrently(texts, get_embeddings_model().embed_documents, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_CHARS, workers)
+
+def embed_texts(texts, workers=EMBEDDING_WORKERS):
+    """Embed texts with as few ``embed_documents`` requests as the batch limits allow.
+
+    Texts already in the embedding cache, and repeats within ``texts``, are
+    not sent to the API. Up to ``workers`` requests run at once; texts whose
+    request failed after all retries come back as ``None``.
+    """
+    return get_embedding_cache().embed(texts, lambda missing: _embed_uncached(missing, workers))
+
+def embed_column(df, column, workers=EMBEDDING_WORKERS):
+    """Embed every value of a DataFrame column with ``embed_texts``.
+
+    Empty and missing values get a zero vector. Values whose request failed
+    after all retries are left ``None`` and their rows are logged. Embedded
+    values are cached, so running the script again only sends the failed ones.
+    """
+    # NaN is the only value not equal to itself
+    texts = [value if isinstance(value, str) else "" if value is None or value != value else str(value)
+             for value in df[column]]
+    present = [i for i, text in enumerate(texts) if text.strip()]
+    vectors = [[0.0] * get_embeddings_model().dimensions for _ in texts]
+    for i, embedding in zip(present, embed_texts([texts[i] for i in present], workers)):
+        vectors[i] = embedding
+    failed = [i for i, vector in enumerate(vectors) if vector is None]
+    if failed:
+        logging.error(f"{len(failed)} values of {column} could not be embedded, rerun to retry them (rows {failed})")
+    return vectors
+
+def calculate_embeddings_batch(documents, workers=EMBEDDING_WORKERS):
+    """Add ``<field>_embedding`` vectors to many documents at once.
+
+    The texts of every field of every document are embedded together in
+    batched requests and the vectors are scattered back to their documents.
+    Returns ``{document index: [fields]}`` for the fields that could not be
+    embedded; those documents are incomplete and should not be saved.
+    """
+    targets = []
+    texts = []
+    for index, data in enumerate(documents):
+        for field in FIELDS_TO_EMBED:
+            if data.get(field) is not None and isinstance(data[field], str):
+                targets.append((index, field))
+                texts.append(data[field])
+
+    failed = {}
+    for (index, field), embedding in zip(targets, embed_texts(texts, workers)):
+        if embedding is None:
+            failed.setdefault(index, []).append(field)
+        else:
+            documents[index][f"{field}_embedding"] = embedding
+
+    return failed
 
 def calculate_embeddings(data):
     # Calculate embeddings for relevant fields based on the mapping
-    fields_to_embed = [
-        'contact_information_address',
-        'education_degrees',
-        'education_field_of_study',
-        'education_descriptions',
-        'work_experience_job_titles',
-        'work_experience_industry',
-        'work_experience_locations',
-        'work_experience_descriptions',
-        'skills',
-    ]
-    
-    for field in fields_to_embed:
-        if data.get(field) is not None and isinstance(data[field], str):
-            # Add the embedding directly to the object
-            embedding = embeddings_model.embed_query(data[field])
-            data[f"{field}_embedding"] = embedding
-    
+    failed = calculate_embeddings_batch([data])
+    if failed:
+        raise RuntimeError(f"Could not embed fields {failed[0]}")
     return data
 
+def save_embedded_documents(documents, output_dir, store, clusters=None):
+    """Save embedded ``(filename, data)`` documents as vectors in ``store`` plus slim JSON.
+
+    The ``*_embedding`` keys are moved out of each document into the vector
+    store, which is written before any JSON, so an existing JSON file means
+    its vectors are stored too. Near-duplicate members listed in
+    ``clusters`` get the representative's vectors and JSON as well.
+    """
+    clusters = clusters or {}
+    rows = []
+    for filename, data in documents:
+        vectors = {key: data.pop(key) for key in [key for key in data if key.endswith('_embedding')]}
+        rows.append((data.get('document_id', os.path.splitext(filename)[0]), vectors))
+        rows.extend((document_id, vectors) for document_id in _missing_members(clusters.get(filename, ()), output_dir))
+    store.append(rows)
+
+    for filename, data in documents:
+        with open(os.path.join(output_dir, filename), 'w') as f:
+            json.dump(data, f, indent=2)
+        if filename in clusters:
+            fan_out(data, clusters[filename], output_dir)
+
+def fan_out_embedded(data, vectors, members, output_dir, store):
+    """Copy a representative's vectors and JSON to the near duplicates that do not have them yet."""
+    if vectors:
+        store.append([(document_id, vectors) for document_id in _missing_members(members, output_dir)])
+    return fan_out(data, members, output_dir)
+
+def _missing_members(members, output_dir):
+    document_ids = [os.path.splitext(member)[0] for member in members]
+    return [document_id for document_id in document_ids
+            if not os.path.exists(os.path.join(output_dir, f"{document_id}.json"))]
+
 def embed_json_file(input_file_path, output_file_path):
     setup_logging('embeddings_calculation')
-    os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+    output_dir = os.path.dirname(output_file_path)
+    os.makedirs(output_dir, exist_ok=True)
     
     # Skip processing if the output file already exists
     if os.path.exists(output_file_path):
@@ -47,36 +164,98 @@ def embed_json_file(input_file_path, output_file_path):
     # Calculate embeddings
     updated_data = calculate_embeddings(data)
     
-    # Save updated JSON with embeddings
-    with open(output_file_path, 'w') as f:
-        json.dump(updated_data, f, indent=2)
+    # Save vectors to the sidecar store and the remaining fields as JSON
+    store = open_vector_store(output_dir)
+    save_embedded_documents([(os.path.basename(output_file_path), updated_data)], output_dir, store)
     logging.info(f"Successfully saved {os.path.basename(output_file_path)}")
 
-def embed_json_files(input_dir, output_dir):
+def embed_json_files(input_dir, output_dir, clusters_path=None, workers=EMBEDDING_WORKERS):
+    """Embed every parsed document of ``input_dir`` into ``output_dir``.
+
+    Vectors go to the binary sidecar in ``<output_dir>/vectors`` and the
+    documents are written as slim JSON without them. Up to ``workers``
+    embedding requests run at once. Documents that still fail after the
+    request retries get one more pass at the end; the rest are listed in
+    ``<output_dir>/embedding_retry.jsonl`` and left unsaved, so the next run
+    picks them up again.
+    """
     setup_logging('embeddings_calculation')
     os.makedirs(output_dir, exist_ok=True)
+    store = open_vector_store(output_dir)
+    retry_queue = RetryQueue(os.path.join(output_dir, "embedding_retry.jsonl"))
+    queued = retry_queue.load()
+    if queued:
+        logging.info(f"Retrying {len(queued)} documents that failed in the last run")
+        retry_queue.clear()
     
     file_count = 0  # Initialize counter
+    failed = []
+
+    # Near duplicates are embedded once, through their cluster representative
+    clusters = {f"{os.path.splitext(representative)[0]}.json": members
+                for representative, members in load_clusters(clusters_path).items()}
+    duplicates = {f"{os.path.splitext(member)[0]}.json" for members in clusters.values() for member in members}
     
+    pending = []
     for filename in tqdm(os.listdir(input_dir)):
         if filename.endswith('.json'):
             input_file_path = os.path.join(input_dir, filename)
             output_file_path = os.path.join(output_dir, filename)
+
+            if filename in duplicates:
+                logging.info(f"Skipping {filename} - near duplicate, embedded with its representative")
+                continue
             
             # Skip processing if the output file already exists
             if os.path.exists(output_file_path):
                 logging.info(f"Skipping {filename} - already processed")
+                if filename in clusters:
+                    with open(output_file_path, 'r') as f:
+                        data = json.load(f)
+                    vectors = store.get(data.get('document_id', os.path.splitext(filename)[0]))
+                    fan_out_embedded(data, vectors, clusters[filename], output_dir, store)
                 continue
             
             with open(input_file_path, 'r') as f:
-                data = json.load(f)
-            
-            logging.info(f"Calculating embeddings for {filename}")
-            # Calculate embeddings
-            updated_data = calculate_embeddings(data)
-            
-            # Save updated JSON with embeddings
-            with open(output_file_path, 'w') as f:
-                json.dump(updated_data, f, indent=2)
-            logging.info(f"Successfully saved {filename}")
-            
\ No newline at end of file
+                pending.append((filename, json.load(f)))
+
+            if len(pending) >= DOCUMENTS_PER_BATCH:
+                file_count += _embed_and_save(pending, output_dir, clusters, store, failed, workers)
+                pending = []
+
+    file_count += _embed_and_save(pending, output_dir, clusters, store, failed, workers)
+
+    if failed:
+        logging.info(f"Retrying {len(failed)} documents whose embeddings failed")
+        retry = [(filename, data) for filename, data, _ in failed]
+        failed = []
+        file_count += _embed_and_save(retry, output_dir, clusters, store, failed, workers)
+        for filename, _, fields in failed:
+            retry_queue.add(filename=filename, fields=fields)
+        if failed:
+            logging.error(f"{len(failed)} documents could not be embedded, see {retry_queue.path}")
+
+    logging.info(f"Embedded {file_count} documents from {input_dir}")
+
+def _embed_and_save(pending, output_dir, clusters, store, failed, workers):
+    """Embed a group of ``(filename, data)`` documents together and save the complete ones.
+
+    Documents with a field that could not be embedded are appended to
+    ``failed`` as ``(filename, data, fields)``.
+    """
+    if not pending:
+        return 0
+    logging.info(f"Calculating embeddings for {len(pending)} documents")
+    # Calculate embeddings
+    failed_fields = calculate_embeddings_batch([data for _, data in pending], workers)
+    complete = []
+    for index, (filename, data) in enumerate(pending):
+        if index in failed_fields:
+            failed.append((filename, data, failed_fields[index]))
+        else:
+            complete.append((filename, data))
+
+    # Save vectors to the sidecar store and the remaining fields as JSON
+    save_embedded_documents(complete, output_dir, store, clusters)
+    logging.info(f"Successfully saved {len(complete)} documents")
+    return len(complete)
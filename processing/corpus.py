@@ -0,0 +1,129 @@
+import os
+import heapq
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import Dict, Iterable, Iterator, List, Optional
+
+CORPUS_COLUMNS = ["filename", "path", "raw_text", "preprocessed_text"]
+CORPUS_SCHEMA = pa.schema([(column, pa.string()) for column in CORPUS_COLUMNS])
+COMPRESSION = "zstd"
+
+class CorpusWriter:
+    """Append extracted rows to a corpus in bounded chunks.
+
+    Rows are spooled into ``<path>`` as a directory of Parquet part files, one
+    per chunk. Each part is written to a temporary name and renamed, so a
+    crash only loses the chunk that was in flight. ``commit`` folds the parts
+    into a single Parquet file with one row group per part.
+    """
+
+    def __init__(self, path: str, append: bool = False):
+        self.path = path
+        self.rows_written = 0
+        if not append and os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path, exist_ok=True)
+        self._parts = len(_part_files(path))
+
+    def write(self, rows: List[Dict]):
+        if not rows:
+            return
+        table = pa.Table.from_pylist([{column: row.get(column) for column in CORPUS_COLUMNS} for row in rows],
+                                     schema=CORPUS_SCHEMA)
+        part_path = os.path.join(self.path, f"part-{self._parts:06d}.parquet")
+        pq.write_table(table, f"{part_path}.tmp", compression=COMPRESSION)
+        os.replace(f"{part_path}.tmp", part_path)
+        self._parts += 1
+        self.rows_written += len(rows)
+
+    def commit(self, final_path: str):
+        """Combine the spooled parts into ``final_path`` and remove the spool."""
+        tmp_path = f"{final_path}.tmp"
+        with pq.ParquetWriter(tmp_path, CORPUS_SCHEMA, compression=COMPRESSION) as writer:
+            for part_path in _part_files(self.path):
+                writer.write_table(pq.read_table(part_path, memory_map=True))
+        os.replace(tmp_path, final_path)
+        shutil.rmtree(self.path)
+
+def _part_files(directory: str) -> List[str]:
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".parquet"))
+
+def read_corpus(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Load a corpus, or only the requested ``columns`` of it, into a DataFrame.
+
+    Parquet files are memory-mapped and unrequested columns are never read.
+    Legacy ``.csv`` corpora are still accepted.
+    """
+    if path.endswith(".csv"):
+        return pd.read_csv(path, usecols=columns)
+    return pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+
+def iter_corpus(path: str, columns: Optional[List[str]] = None, chunk_size: int = 1000) -> Iterator[pd.DataFrame]:
+    """Yield the corpus in DataFrame chunks of at most ``chunk_size`` rows.
+
+    ``path`` can be a committed Parquet file, a writer's spool directory or a
+    legacy CSV corpus.
+    """
+    if not os.path.exists(path):
+        return
+    if os.path.isdir(path):
+        for part_path in _part_files(path):
+            yield from iter_corpus(part_path, columns, chunk_size)
+    elif path.endswith(".csv"):
+        if os.path.getsize(path) > 0:
+            yield from pd.read_csv(path, usecols=columns, chunksize=chunk_size)
+    else:
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+
+def iter_rows(path: str, chunk_size: int = 1000) -> Iterator[Dict]:
+    """Yield corpus rows one by one while only holding one chunk in memory."""
+    for chunk in iter_corpus(path, chunk_size=chunk_size):
+        yield from chunk.fillna("").to_dict('records')
+
+def merge_corpus(base_path: str, delta_path: str, output_path: str, drop_paths: set, chunk_size: int = 1000) -> int:
+    """Merge a sorted delta corpus into a sorted base corpus.
+
+    Rows of the base whose ``path`` is in ``drop_paths`` are left out, which
+    covers both replaced and deleted files. Both inputs are streamed, so the
+    merge runs in constant memory. Returns the number of rows written.
+    """
+    base_rows = (row for row in iter_rows(base_path, chunk_size) if row["path"] not in drop_paths)
+    merged = heapq.merge(base_rows, iter_rows(delta_path, chunk_size),
+                         key=lambda row: (row["filename"], row["path"]))
+
+    writer = CorpusWriter(f"{output_path}.merging")
+    rows = []
+    for row in merged:
+        rows.append(row)
+        if len(rows) >= chunk_size:
+            writer.write(rows)
+            rows = []
+    writer.write(rows)
+    writer.commit(output_path)
+    return writer.rows_written
+
+def prune_outputs(corpus_path: str, output_dir: str, keep: Iterable[str] = ()) -> List[str]:
+    """Remove the ``<document_id>.json`` outputs, and their sidecar vectors, of files no longer in a corpus.
+
+    Files named in ``keep`` (e.g. state files kept next to the documents)
+    are never removed. Returns the removed document ids.
+    """
+    if not os.path.isdir(output_dir):
+        return []
+    document_ids = {os.path.splitext(filename)[0] for filename in read_corpus(corpus_path, columns=["filename"])["filename"]}
+    removed = [os.path.splitext(name)[0] for name in os.listdir(output_dir)
+               if name.endswith(".json") and name not in keep and os.path.splitext(name)[0] not in document_ids]
+    for document_id in removed:
+        os.remove(os.path.join(output_dir, f"{document_id}.json"))
+
+    from processing.vector_store import VectorStore, vector_dir_for
+    vector_dir = vector_dir_for(output_dir)
+    if removed and os.path.exists(os.path.join(vector_dir, "meta.json")):
+        VectorStore(vector_dir).remove(removed)
+    if removed:
+        print(f"Removed {len(removed)} documents from {output_dir} whose source left {corpus_path}.")
+    return removed
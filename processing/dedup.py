@@ -0,0 +1,141 @@
+import os
+import re
+import json
+import hashlib
+import numpy as np
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+NUM_PERM = 128
+BANDS = 16  # 16 bands of 8 rows: pairs above ~0.7 Jaccard become LSH candidates
+SHINGLE_SIZE = 5
+_PRIME = np.uint64(4294967311)  # Smallest prime above 2**32
+
+def clusters_path_for(corpus_path: str) -> str:
+    """Return the path of the near-duplicate clusters computed for a corpus."""
+    return f"{corpus_path}.clusters.json"
+
+def _permutations(num_perm: int) -> tuple:
+    rng = np.random.RandomState(1)
+    a = rng.randint(1, 2**32, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, 2**32, size=num_perm, dtype=np.uint64)
+    return a, b
+
+def shingle_hashes(text: str, shingle_size: int = SHINGLE_SIZE) -> np.ndarray:
+    """Hash the overlapping word shingles of a text to 32-bit integers."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < shingle_size:
+        shingles = {" ".join(words)} if words else set()
+    else:
+        shingles = {" ".join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)}
+    return np.array([int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), 'little')
+                     for s in shingles], dtype=np.uint64)
+
+def minhash_signature(hashes: np.ndarray, permutations: tuple) -> np.ndarray:
+    """Compute the MinHash signature of a set of shingle hashes."""
+    a, b = permutations
+    # Shingle hashes and coefficients are below 2**32, so a * x fits in 64 bits
+    values = (np.outer(hashes, a) + b) % _PRIME
+    return values.min(axis=0).astype(np.uint32)
+
+def find_near_duplicates(corpus_path: str, threshold: float = 0.85, output_path: Optional[str] = None,
+                         chunk_size: int = 1000, force: bool = False) -> Dict[str, List[str]]:
+    """Cluster near-duplicate documents of an extracted corpus.
+
+    Documents are fingerprinted with MinHash over word shingles of
+    ``preprocessed_text`` and LSH banding proposes candidate pairs; pairs
+    whose estimated Jaccard similarity reaches ``threshold`` are merged into
+    clusters. The longest document of each cluster is its representative.
+
+    Returns ``{representative_filename: [member filenames]}`` for clusters
+    with more than one document and writes it to ``output_path`` (by default
+    ``<corpus>.clusters.json``). Clusters newer than the corpus are reused
+    as they are unless ``force`` is set (e.g. after changing ``threshold``).
+    """
+    output_path = output_path or clusters_path_for(corpus_path)
+    if not force and os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(corpus_path):
+        print(f"{output_path} is up to date with {corpus_path}. Skipping clustering.")
+        return load_clusters(output_path)
+
+    # pandas and pyarrow are only loaded here, not by the stages that just read clusters
+    from processing.corpus import iter_corpus
+    permutations = _permutations(NUM_PERM)
+    rows_per_band = NUM_PERM // BANDS
+
+    filenames = []
+    lengths = []
+    signatures = []
+    for chunk in iter_corpus(corpus_path, columns=["filename", "preprocessed_text"], chunk_size=chunk_size):
+        for filename, text in zip(chunk["filename"], chunk["preprocessed_text"].fillna("")):
+            hashes = shingle_hashes(text)
+            filenames.append(filename)
+            lengths.append(len(text))
+            # Empty documents get no signature and are never clustered
+            signatures.append(minhash_signature(hashes, permutations) if len(hashes) else None)
+
+    parent = list(range(len(filenames)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for band in range(BANDS):
+        buckets = defaultdict(list)
+        for index, signature in enumerate(signatures):
+            if signature is not None:
+                buckets[signature[band * rows_per_band:(band + 1) * rows_per_band].tobytes()].append(index)
+        for members in buckets.values():
+            first = members[0]
+            for other in members[1:]:
+                root_first, root_other = find(first), find(other)
+                if root_first == root_other:
+                    continue
+                similarity = np.mean(signatures[first] == signatures[other])
+                if similarity >= threshold:
+                    parent[root_other] = root_first
+
+    groups = defaultdict(list)
+    for index in range(len(filenames)):
+        groups[find(index)].append(index)
+
+    clusters = {}
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        representative = min(members, key=lambda i: (-lengths[i], filenames[i]))
+        clusters[filenames[representative]] = sorted(filenames[i] for i in members if i != representative)
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(clusters, f, indent=2, sort_keys=True)
+
+    duplicates = sum(len(members) for members in clusters.values())
+    print(f"Found {len(clusters)} near-duplicate clusters in {corpus_path}; "
+          f"{duplicates} of {len(filenames)} documents will reuse their representative's parse.")
+    return clusters
+
+def load_clusters(clusters_path: Optional[str]) -> Dict[str, List[str]]:
+    """Load near-duplicate clusters, or an empty mapping when there are none."""
+    if not clusters_path or not os.path.exists(clusters_path):
+        return {}
+    with open(clusters_path, 'r') as f:
+        return json.load(f)
+
+def fan_out(data: Dict, members: List[str], output_dir: str) -> int:
+    """Write a copy of a representative's JSON for every cluster member.
+
+    Each copy carries the member's own ``document_id``; existing files are
+    left alone. Returns the number of files written.
+    """
+    written = 0
+    for member in members:
+        document_id = os.path.splitext(member)[0]
+        member_file = os.path.join(output_dir, f"{document_id}.json")
+        if os.path.exists(member_file):
+            continue
+        with open(member_file, 'w') as f:
+            json.dump(dict(data, document_id=document_id), f, indent=2)
+        written += 1
+    return written
@@ -0,0 +1,105 @@
+import os
+import re
+import fcntl
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+import numpy as np
+from typing import Callable, List, Optional, Sequence
+
+EMBEDDING_CACHE_DIR = "data/cache/embeddings"
+
+def normalize_text(text: str) -> str:
+    """Canonical form of a text for caching: NFC, collapsed whitespace, no padding."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+def embedding_key(text: str, model: str, dimensions: int) -> str:
+    """Cache key of a normalized text's embedding under one model and dimension."""
+    return hashlib.sha256(f"{model}\x1f{dimensions}\x1f{text}".encode('utf-8')).hexdigest()
+
+class EmbeddingCache:
+    """Content-addressable store of embeddings for one model and dimension.
+
+    Vectors are appended as float32 rows to ``<model>-<dimensions>.f32``, which
+    is read through a memory map, and a SQLite index maps each text's key to
+    its row. A vector is written before its index entry, and a partial row
+    left by an interrupted write is truncated before the next append, so an
+    interrupted write leaves at most an unreferenced row behind. Appends hold
+    an exclusive lock on ``<name>.lock``, so processes can share a cache.
+    """
+
+    def __init__(self, model: str, dimensions: int, directory: str = EMBEDDING_CACHE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.model = model
+        self.dimensions = dimensions
+        name = f"{re.sub(r'[^A-Za-z0-9_.-]', '_', model)}-{dimensions}"
+        self.vectors_path = os.path.join(directory, f"{name}.f32")
+        self.lock_path = os.path.join(directory, f"{name}.lock")
+        self._row_bytes = dimensions * np.dtype(np.float32).itemsize
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._conn = sqlite3.connect(os.path.join(directory, f"{name}.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self._conn.commit()
+
+    def _rows(self) -> int:
+        return os.path.getsize(self.vectors_path) // self._row_bytes if os.path.exists(self.vectors_path) else 0
+
+    def _vector(self, row: int) -> np.ndarray:
+        if self._vectors is None or row >= len(self._vectors):
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(self._rows(), self.dimensions))
+        return self._vectors[row]
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Look up normalized texts; missing ones come back as ``None``."""
+        keys = [embedding_key(text, self.model, self.dimensions) for text in texts]
+        with self._lock:
+            rows = {}
+            # SQLite limits the number of bound parameters per statement
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                query = f"SELECT key, row FROM vectors WHERE key IN ({','.join('?' * len(chunk))})"
+                rows.update(self._conn.execute(query, chunk).fetchall())
+            return [self._vector(rows[key]) if key in rows else None for key in keys]
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """Store the vectors of normalized texts."""
+        if not texts:
+            return
+        array = np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dimensions)
+        with self._lock, open(self.lock_path, 'a') as lock:
+            # Other processes appending to the same cache wait here
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            first_row = self._rows()
+            with open(self.vectors_path, 'ab') as f:
+                # Drop a partial row of an interrupted write so rows stay aligned
+                f.truncate(first_row * self._row_bytes)
+                f.write(array.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO vectors VALUES (?, ?)",
+                [(embedding_key(text, self.model, self.dimensions), first_row + i) for i, text in enumerate(texts)],
+            )
+            self._conn.commit()
+
+    def embed(self, texts: Sequence[str],
+              embed_documents: Callable[[List[str]], List[Optional[List[float]]]]) -> List[Optional[List[float]]]:
+        """Embed texts through the cache.
+
+        Texts are normalized and only distinct texts that are not cached yet
+        are passed to ``embed_documents``, in one call. Results are returned
+        in input order; texts ``embed_documents`` returned ``None`` for are
+        not cached and stay ``None``.
+        """
+        normalized = [normalize_text(text) for text in texts]
+        unique = list(dict.fromkeys(normalized))
+        found = dict(zip(unique, self.get_many(unique)))
+        missing = [text for text in unique if found[text] is None]
+        if missing:
+            embedded = [(text, vector) for text, vector in zip(missing, embed_documents(missing)) if vector is not None]
+            self.put_many([text for text, _ in embedded], [vector for _, vector in embedded])
+            found.update((text, np.asarray(vector, dtype=np.float32)) for text, vector in embedded)
+        return [found[text].tolist() if found[text] is not None else None for text in normalized]
@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Iterator, List, Optional, Sequence
+
+EMBEDDING_WORKERS = 8  # Embedding requests in flight at once
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0  # Seconds before the first retry, doubled on every further attempt
+BACKOFF_MAX = 60.0
+
+def text_batches(texts: Sequence[str], batch_size: int, batch_chars: int) -> Iterator[List[str]]:
+    """Split texts into consecutive batches bounded by count and total characters."""
+    batch = []
+    chars = 0
+    for text in texts:
+        if batch and (len(batch) >= batch_size or chars + len(text) > batch_chars):
+            yield batch
+            batch = []
+            chars = 0
+        batch.append(text)
+        chars += len(text)
+    if batch:
+        yield batch
+
+@lru_cache(maxsize=1)
+def retryable_errors() -> tuple:
+    """Failures worth waiting out; anything else (e.g. a rejected input) fails at once."""
+    import openai
+    return (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+def with_retry(fn: Callable, *args, max_retries: int = MAX_RETRIES, base_delay: float = BACKOFF_BASE,
+               max_delay: float = BACKOFF_MAX):
+    """Call ``fn(*args)``, retrying retryable API errors with jittered exponential backoff."""
+    for attempt in range(max_retries + 1):
+        try:
+            return fn(*args)
+        except retryable_errors() as e:
+            if attempt == max_retries:
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+            logging.warning(f"{type(e).__name__} from embedding API, retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+def embed_concurrently(texts: Sequence[str], embed_documents: Callable[[List[str]], List[List[float]]],
+                       batch_size: int, batch_chars: int, workers: int = EMBEDDING_WORKERS,
+                       max_retries: int = MAX_RETRIES) -> List[Optional[List[float]]]:
+    """Embed texts in batched requests with up to ``workers`` requests in flight.
+
+    Every request is retried with backoff. A request rejected with a
+    non-retryable error (e.g. one invalid input) is split in halves until
+    the rejected texts are isolated, so only they fail. Failed texts come
+    back as ``None`` so the caller can queue them for another run; they are
+    never replaced by placeholder vectors.
+    """
+    spans = []
+    start = 0
+    for batch in text_batches(texts, batch_size, batch_chars):
+        spans.append((start, batch))
+        start += len(batch)
+
+    def embed_batch(batch):
+        try:
+            return with_retry(embed_documents, batch, max_retries=max_retries)
+        except retryable_errors() as e:
+            # Still failing after all retries: the API is unavailable, splitting would not help
+            logging.error(f"Embedding request for {len(batch)} texts failed: {e}")
+            return [None] * len(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                logging.error(f"Embedding request for 1 text was rejected: {e}")
+                return [None]
+            middle = len(batch) // 2
+            return embed_batch(batch[:middle]) + embed_batch(batch[middle:])
+
+    def run(span):
+        start, batch = span
+        return start, embed_batch(batch)
+
+    results = [None] * len(texts)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for start, vectors in pool.map(run, spans):
+            results[start:start + len(vectors)] = vectors
+    return results
+
+class RetryQueue:
+    """JSON-lines file of items that could not be embedded, kept for the next run."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def add(self, **item):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(dict(item, failed_at=time.time())) + "\n")
+
+    def load(self) -> List[dict]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,100 @@
+import re
+import zlib
+import numpy as np
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+DEFAULT_MODEL = "text-embedding-3-large"
+DEFAULT_DIMENSIONS = 1024
+
+class EmbeddingProvider(ABC):
+    """Interface of an embedding backend.
+
+    ``name`` identifies the vectors a provider produces (model and settings),
+    so caches of different providers never mix.
+    """
+
+    name: str
+    dimensions: int
+
+    @abstractmethod
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts in one request, in input order."""
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+class OpenAIProvider(EmbeddingProvider):
+    """OpenAI embeddings through LangChain, the production backend."""
+
+    def __init__(self, model: str = DEFAULT_MODEL, dimensions: int = DEFAULT_DIMENSIONS):
+        self.name = model
+        self.dimensions = dimensions
+        self._client = None
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self._client is None:
+            # LangChain and the OpenAI SDK are loaded on the first request
+            from langchain_openai import OpenAIEmbeddings
+            from config.config import OPENAI_API_KEY
+            self._client = OpenAIEmbeddings(model=self.name, openai_api_key=OPENAI_API_KEY, dimensions=self.dimensions)
+        return self._client.embed_documents(texts)
+
+class HashingProvider(EmbeddingProvider):
+    """Deterministic CPU-only embeddings for offline load tests and benchmarks.
+
+    Words, word bigrams and character n-grams of the lowercased text are
+    hashed with CRC32 into ``dimensions`` signed buckets and the result is
+    L2-normalized. Texts sharing vocabulary get similar vectors, which is
+    enough to exercise kNN search; the vectors carry no real semantics.
+    """
+
+    def __init__(self, dimensions: int = DEFAULT_DIMENSIONS, min_n: int = 3, max_n: int = 5):
+        self.name = f"hashing-ngram-{min_n}-{max_n}"
+        self.dimensions = dimensions
+        self.min_n = min_n
+        self.max_n = max_n
+
+    def _features(self, text: str) -> List[str]:
+        text = re.sub(r"\s+", " ", text.lower()).strip()
+        words = re.findall(r"\w+", text)
+        features = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+        padded = f" {text} "
+        for n in range(self.min_n, self.max_n + 1):
+            features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return features
+
+    def _embed(self, text: str) -> List[float]:
+        features = self._features(text)
+        if not features:
+            return [0.0] * self.dimensions
+        hashes = np.fromiter((zlib.crc32(feature.encode('utf-8')) for feature in features), dtype=np.uint32,
+                             count=len(features))
+        signs = np.where(hashes >> np.uint32(31), -1.0, 1.0)
+        vector = np.bincount(hashes % self.dimensions, weights=signs, minlength=self.dimensions)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).astype(np.float32).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+PROVIDERS = {
+    "openai": OpenAIProvider,
+    "hashing": HashingProvider,
+}
+
+def get_embedding_provider(name: Optional[str] = None, model: Optional[str] = None,
+                           dimensions: Optional[int] = None) -> EmbeddingProvider:
+    """Build the embedding provider selected by ``name`` or the ``EMBEDDING_PROVIDER`` setting.
+
+    ``"openai"`` (the default) calls the OpenAI API; ``"hashing"`` runs the
+    offline ``HashingProvider``.
+    """
+    from config.config import EMBEDDING_PROVIDER, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS
+    name = name or EMBEDDING_PROVIDER
+    dimensions = dimensions or EMBEDDING_DIMENSIONS
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown embedding provider: {name} (choose from {', '.join(PROVIDERS)})")
+    if name == "openai":
+        return OpenAIProvider(model or EMBEDDING_MODEL, dimensions)
+    return PROVIDERS[name](dimensions)
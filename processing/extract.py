@@ -1,39 +1,157 @@
 import os
 import re
-import pandas as pd
 import unicodedata
 from PyPDF2 import PdfReader
 from docx import Document
-from typing import List, Dict
-from pathlib import Path
+import time
+from typing import List, Dict, Optional
+from concurrent.futures import ProcessPoolExecutor
+import shutil
 import subprocess
+import uuid
 import magic
+from processing.corpus import CorpusWriter, iter_corpus, merge_corpus
+from processing.scan import scan_directory
+from processing.manifest import manifest_path_for, load_manifest, save_manifest, diff_manifest
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    """Extract text content from a PDF file."""
+DOC_TIMEOUT = 30  # Seconds allowed per legacy .doc file
+PARALLEL_PDF_MIN_PAGES = 50  # Smaller PDFs are not worth splitting across processes
+PARALLEL_PDF_RANGE_PAGES = 10  # Pages per range when a character budget may end extraction early
+
+def extract_text_from_pdf(pdf_path: str, max_pages: Optional[int] = None, max_chars: Optional[int] = None,
+                          page_workers: int = 1) -> str:
+    """Extract text content from a PDF file.
+
+    Pages are streamed and extraction stops after ``max_pages`` pages or once
+    ``max_chars`` characters were collected. PDFs with at least
+    ``PARALLEL_PDF_MIN_PAGES`` pages are split across ``page_workers``
+    processes when more than one is requested; with ``max_chars`` they are
+    extracted in rounds of page ranges and the budget is checked after each round.
+    """
     try:
         reader = PdfReader(pdf_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text()
+        page_count = len(reader.pages)
+        if max_pages is not None:
+            page_count = min(page_count, max_pages)
+
+        if page_workers > 1 and page_count >= PARALLEL_PDF_MIN_PAGES:
+            parts = _extract_pdf_pages_parallel(pdf_path, page_count, page_workers, max_chars)
+        else:
+            parts = []
+            collected = 0
+            for index in range(page_count):
+                page_text = reader.pages[index].extract_text() or ""
+                parts.append(page_text)
+                collected += len(page_text)
+                if max_chars is not None and collected >= max_chars:
+                    break
+
+        text = "".join(parts)
+        if max_chars is not None:
+            text = text[:max_chars]
         return text.strip()
     except Exception as e:
         print(f"Error extracting text from {pdf_path}: {e}")
         return ""
 
-def extract_text_from_doc(doc_path: str) -> str:
+def _extract_pdf_page_range(pdf_path: str, start: int, stop: int) -> str:
+    reader = PdfReader(pdf_path)
+    return "".join(reader.pages[index].extract_text() or "" for index in range(start, stop))
+
+def _extract_pdf_pages_parallel(pdf_path: str, page_count: int, page_workers: int,
+                                max_chars: Optional[int] = None) -> List[str]:
+    """Extract contiguous page ranges of one PDF in separate processes, in page order.
+
+    Without ``max_chars`` each worker gets one range. Otherwise ranges of
+    ``PARALLEL_PDF_RANGE_PAGES`` pages run in rounds of ``page_workers`` and
+    no further round starts once ``max_chars`` characters were collected.
+    """
+    step = -(-page_count // page_workers)
+    if max_chars is not None:
+        step = min(step, PARALLEL_PDF_RANGE_PAGES)
+    starts = list(range(0, page_count, step))
+    stops = [min(start + step, page_count) for start in starts]
+    parts = []
+    collected = 0
+    with ProcessPoolExecutor(max_workers=min(page_workers, len(starts))) as executor:
+        for i in range(0, len(starts), page_workers):
+            round_parts = list(executor.map(_extract_pdf_page_range, [pdf_path] * len(starts[i:i + page_workers]),
+                                            starts[i:i + page_workers], stops[i:i + page_workers]))
+            parts.extend(round_parts)
+            collected += sum(len(part) for part in round_parts)
+            if max_chars is not None and collected >= max_chars:
+                break
+    return parts
+
+def extract_text_from_doc(doc_path: str, timeout: int = DOC_TIMEOUT) -> str:
     """Extract text content from a DOC file using catdoc."""
     try:
-        result = subprocess.run(['catdoc', doc_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        result = subprocess.run(['catdoc', doc_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=timeout)
         if result.returncode == 0:
             return result.stdout.strip()
         else:
             print(f"Error extracting text from {doc_path}: {result.stderr}")
             return ""
+    except subprocess.TimeoutExpired:
+        print(f"Error extracting text from {doc_path}: catdoc timed out after {timeout}s")
+        return ""
     except Exception as e:
         print(f"Error extracting text from {doc_path}: {e}")
         return ""
 
+# Runs catdoc over many files from one shell so Python forks once per batch.
+# Each document is framed by marker lines carrying catdoc's exit status, and
+# coreutils timeout (when available) bounds the time spent on any one file.
+_CATDOC_BATCH_SCRIPT = r"""
+mark=$1; limit=$2; shift 2
+if command -v timeout >/dev/null 2>&1; then run="timeout $limit"; else run=""; fi
+for f do
+    printf '%s BEGIN\n' "$mark"
+    $run catdoc "$f" 2>/dev/null
+    printf '\n%s END %d\n' "$mark" $?
+done
+"""
+
+def extract_text_from_docs(doc_paths: List[str], timeout: int = DOC_TIMEOUT) -> Dict[str, str]:
+    """Extract text content from many DOC files with a single batched catdoc run.
+
+    Returns a mapping of path to text. Files the batch could not report on,
+    for example because the whole batch ran out of time, are retried one by
+    one with ``extract_text_from_doc``.
+    """
+    if not doc_paths:
+        return {}
+
+    mark = f"@@catdoc-{uuid.uuid4().hex}@@"
+    try:
+        result = subprocess.run(
+            ['sh', '-c', _CATDOC_BATCH_SCRIPT, 'sh', mark, str(timeout), *doc_paths],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+            timeout=timeout * len(doc_paths) + 5,
+        )
+        output = result.stdout
+    except Exception as e:
+        print(f"Batched catdoc failed for {len(doc_paths)} files: {e}")
+        output = ""
+
+    texts = {}
+    pattern = re.compile(rf"{re.escape(mark)} BEGIN\n(.*?)\n{re.escape(mark)} END (\d+)\n", re.S)
+    for doc_path, match in zip(doc_paths, pattern.finditer(output)):
+        status = int(match.group(2))
+        if status == 0:
+            texts[doc_path] = match.group(1).strip()
+        elif status == 124:
+            print(f"Error extracting text from {doc_path}: catdoc timed out after {timeout}s")
+            texts[doc_path] = ""
+        else:
+            print(f"Error extracting text from {doc_path}: catdoc exited with status {status}")
+            texts[doc_path] = ""
+
+    for doc_path in doc_paths:
+        if doc_path not in texts:
+            texts[doc_path] = extract_text_from_doc(doc_path, timeout)
+    return texts
+
 def extract_text_from_docx(docx_path: str) -> str:
     """Extract text content from a DOCX file."""
     try:
@@ -59,69 +177,202 @@ def preprocess_text(text: str) -> str:
     sanitized_text = sanitize_text(text)
     return sanitized_text
 
-def process_files(base_dir: str, output_csv: str, file_types: List[str], filter_set: set = None) -> pd.DataFrame:
-    """Recursively process all specified file types in directory and subdirectories."""
-    data = []
-    base_path = Path(base_dir)
-    mime = magic.Magic(mime=True)
+_mime = None
+
+def detect_mime_type(file_path: str) -> str:
+    """Detect the MIME type of a file, reusing one libmagic handle per process."""
+    global _mime
+    if _mime is None:
+        _mime = magic.Magic(mime=True)
+    return _mime.from_file(file_path)
+
+def extract_files(file_paths: List[str], relative_paths: List[str], mime_types: List[Optional[str]],
+                  pdf_options: Optional[Dict] = None) -> List[Dict]:
+    """Extract and preprocess a batch of files.
+
+    Runs inside pool workers, so failures are returned in the ``error`` key
+    instead of being raised and killing the pool. The MIME type is sniffed
+    only when the catalog does not already know it and is sent back to the
+    parent in ``mime_type``. All DOC files of the batch share one catdoc run.
+    ``pdf_options`` are passed on to ``extract_text_from_pdf``.
+    """
+    pdf_options = pdf_options or {}
+    results = []
+    for file_path, relative_path, mime_type in zip(file_paths, relative_paths, mime_types):
+        result = {"filename": os.path.basename(file_path), "path": relative_path, "mime_type": mime_type,
+                  "error": None, "unsupported": None}
+        try:
+            if mime_type is None:
+                result["mime_type"] = detect_mime_type(file_path)
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        results.append(result)
+
+    doc_paths = [file_path for file_path, result in zip(file_paths, results)
+                 if not result["error"] and result["mime_type"] == 'application/msword']
+    try:
+        doc_texts = extract_text_from_docs(doc_paths)
+    except Exception as e:
+        print(f"Batched DOC extraction failed: {e}")
+        doc_texts = {}
+
+    for file_path, result in zip(file_paths, results):
+        if result["error"]:
+            continue
+        mime_type = result["mime_type"]
+        try:
+            if mime_type == 'application/pdf':
+                extracted_text = extract_text_from_pdf(file_path, **pdf_options)
+            elif mime_type == 'application/msword':
+                extracted_text = doc_texts[file_path] if file_path in doc_texts else extract_text_from_doc(file_path)
+            elif mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
+                extracted_text = extract_text_from_docx(file_path)
+            else:
+                result["unsupported"] = mime_type
+                continue
+
+            result["raw_text"] = extracted_text
+            result["preprocessed_text"] = preprocess_text(extracted_text)
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+    return results
+
+def extract_file(file_path: str, relative_path: str, mime_type: Optional[str] = None,
+                 pdf_options: Optional[Dict] = None) -> Dict:
+    """Extract and preprocess a single file."""
+    return extract_files([file_path], [relative_path], [mime_type], pdf_options)[0]
+
+def _extract_batch(batch: List) -> List[Dict]:
+    return extract_files(*batch)
+
+def process_files(base_dir: str, output_path: str, file_types: List[str], filter_set: set = None,
+                  workers: Optional[int] = 1, chunk_size: int = 500, pdf_max_pages: Optional[int] = None,
+                  pdf_max_chars: Optional[int] = None, pdf_page_workers: int = 1) -> int:
+    """Recursively process all specified file types in directory and subdirectories.
+
+    With ``workers`` > 1 files are extracted in a process pool (``None`` uses
+    every core). Rows are streamed to ``<output_path>.partial`` in Parquet
+    parts of ``chunk_size`` files that are combined into the corpus file once
+    complete, so memory stays flat and an interrupted run resumes where it
+    stopped.
+
+    A manifest next to ``output_path`` records the size, mtime and content hash
+    of every source file. Only new or changed files are extracted, rows of
+    deleted files are dropped and the delta is merged into the existing
+    corpus. Returns the number of files extracted in this run.
+
+    ``pdf_max_pages`` and ``pdf_max_chars`` cap how much of each PDF is read,
+    and ``pdf_page_workers`` splits very large PDFs across processes.
+    """
+    catalog = scan_directory(base_dir)
+    jobs = []
     skipped_files = 0
 
-    # Walk through all subdirectories
-    for root, _, files in os.walk(base_path):
-        for filename in files:
-            file_path = os.path.join(root, filename)
-            file_extension = filename.lower().split('.')[-1]
-            mime_type = mime.from_file(file_path)
-            base_filename = filename.rsplit('-', 1)[0]
-
-            if file_extension in file_types and (filter_set is None or base_filename in filter_set):
-                if mime_type == 'application/pdf':
-                    extracted_text = extract_text_from_pdf(file_path)
-                elif mime_type == 'application/msword':
-                    extracted_text = extract_text_from_doc(file_path)
-                elif mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
-                    extracted_text = extract_text_from_docx(file_path)
-                else:
-                    print(f"Unsupported file type: {mime_type}")
-                    continue
-
-                # Preprocess the extracted text
-                preprocessed_text = preprocess_text(extracted_text)
-
-                # Get relative path for better organization
-                relative_path = os.path.relpath(file_path, base_path)
-                
-                # Add to data list
-                data.append({
-                    "filename": filename,
-                    "path": relative_path,
-                    "raw_text": extracted_text,
-                    "preprocessed_text": preprocessed_text 
-                })
-                print(f"Processed: {relative_path}")
+    for entry in catalog:
+        if entry.extension in file_types and (filter_set is None or entry.base_name in filter_set):
+            jobs.append(entry)
+        else:
+            skipped_files += 1
+
+    # Extracting in filename order means the chunks are written already sorted,
+    # which replaces the in-memory sort of the whole corpus
+    jobs.sort(key=lambda entry: (entry.filename, entry.path))
+
+    # Only new or changed files are extracted; a corpus without a manifest is rebuilt
+    manifest_path = manifest_path_for(output_path)
+    manifest = load_manifest(manifest_path) if os.path.exists(output_path) else {}
+    current_manifest, jobs, deleted_paths = diff_manifest(manifest, jobs)
+    if not jobs and not deleted_paths and os.path.exists(output_path):
+        print(f"{output_path} is up to date with {base_dir}. Skipping processing.")
+        return 0
+    print(f"{len(jobs)} new or changed files, {len(deleted_paths)} deleted files in {base_dir}.")
+
+    partial_path = f"{output_path}.partial"
+    done_paths = set()
+    for chunk in iter_corpus(partial_path, columns=["path"]):
+        done_paths.update(chunk["path"])
+    if done_paths:
+        print(f"Resuming extraction: {len(done_paths)} files already in {partial_path}")
+    pending_jobs = [entry for entry in jobs if entry.path not in done_paths]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pdf_options = {"max_pages": pdf_max_pages, "max_chars": pdf_max_chars, "page_workers": pdf_page_workers}
+
+    failed_paths = []
+    start_time = time.perf_counter()
+    writer = CorpusWriter(partial_path, append=True)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(pending_jobs) > 1 else None
+    try:
+        for i in range(0, len(pending_jobs), chunk_size):
+            window = pending_jobs[i:i + chunk_size]
+            # Workers receive small batches so DOC files can share a catdoc run
+            batch_size = max(1, len(window) // (workers * 8)) if executor is not None else len(window)
+            batches = [([entry.file_path for entry in window[j:j + batch_size]],
+                        [entry.path for entry in window[j:j + batch_size]],
+                        [entry.mime_type for entry in window[j:j + batch_size]],
+                        pdf_options)
+                       for j in range(0, len(window), batch_size)]
+            if executor is not None:
+                batch_results = executor.map(_extract_batch, batches)
             else:
-                skipped_files += 1
+                batch_results = map(_extract_batch, batches)
+            results = (result for batch in batch_results for result in batch)
+            rows, failed = _collect_results(results, catalog)
+            writer.write(rows)
+            failed_paths.extend(failed)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    elapsed = time.perf_counter() - start_time
 
-    # Create DataFrame
-    df = pd.DataFrame(data)
+    if manifest:
+        # Replaced and deleted files drop out of the existing corpus, the delta is merged in order
+        drop_paths = {entry.path for entry in jobs} | deleted_paths
+        total_rows = merge_corpus(output_path, partial_path, output_path, drop_paths)
+        shutil.rmtree(partial_path)
+    else:
+        total_rows = writer.rows_written + len(done_paths)
+        writer.commit(output_path)
 
-    # Sort DataFrame by filename
-    df = df.sort_values(by="filename")
-    
-    # Save DataFrame to CSV
-    os.makedirs(os.path.dirname(output_csv), exist_ok=True)
-    df.to_csv(output_csv, index=False)
+    # Failed files stay out of the manifest so the next run retries them
+    for relative_path in failed_paths:
+        current_manifest.pop(relative_path, None)
+    save_manifest(manifest_path, current_manifest)
+    catalog.save()
     
+    rate = len(pending_jobs) / elapsed if elapsed > 0 else 0.0
+    print(f"Extracted {writer.rows_written} files in {elapsed:.1f}s ({rate:.1f} files/s) with {workers} worker(s).")
+    print(f"{output_path} now holds {total_rows} documents.")
+    if failed_paths:
+        print(f"Failed to extract {len(failed_paths)} files.")
     print(f"Skipped {skipped_files} files from PROFILE because there was no corresponding file in CV.")
     
-    return df
+    return writer.rows_written
+
+def _collect_results(results, catalog) -> tuple:
+    """Log per-file outcomes from the extraction workers and keep the extracted rows."""
+    data = []
+    failed = []
+    for result in results:
+        # Remember sniffed MIME types so later runs do not call libmagic again
+        entry = catalog.get(result["path"])
+        if entry is not None and result["mime_type"]:
+            entry.mime_type = result["mime_type"]
+        if result["error"]:
+            print(f"Error extracting text from {result['path']}: {result['error']}")
+            failed.append(result["path"])
+        elif result["unsupported"]:
+            print(f"Unsupported file type: {result['unsupported']}")
+        else:
+            print(f"Processed: {result['path']}")
+            data.append({key: result[key] for key in ("filename", "path", "raw_text", "preprocessed_text")})
+    return data, failed
 
 def get_base_filenames(directory: str, suffix: str) -> set:
     """Get a set of base filenames (without extensions) from a directory."""
     base_filenames = set()
-    for root, _, files in os.walk(directory):
-        for filename in files:
-            if suffix in filename:
-                base_filename = filename.rsplit('-', 1)[0]
-                base_filenames.add(base_filename)
-    return base_filenames
\ No newline at end of file
+    for entry in scan_directory(directory):
+        if suffix in entry.filename:
+            base_filenames.add(entry.base_name)
+    return base_filenames
@@ -0,0 +1,57 @@
+import os
+import json
+import hashlib
+from typing import Dict, List, Tuple
+
+def manifest_path_for(output_path: str) -> str:
+    """Return the manifest path that tracks the sources of an extracted corpus."""
+    return f"{output_path}.manifest.json"
+
+def file_digest(file_path: str, block_size: int = 1 << 20) -> str:
+    """Compute the SHA-256 hex digest of a file without loading it into memory."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(manifest_path: str) -> Dict[str, Dict]:
+    """Load a manifest mapping relative path to size, mtime and content hash."""
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+def save_manifest(manifest_path: str, manifest: Dict[str, Dict]):
+    """Write the manifest atomically so a crash never leaves it half written."""
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def diff_manifest(manifest: Dict[str, Dict], entries: List) -> Tuple[Dict[str, Dict], List, set]:
+    """Compare the scanned files against a manifest.
+
+    ``entries`` are ``CatalogEntry`` records from the directory scan. Files
+    whose size and mtime match the manifest are trusted without hashing;
+    otherwise the content hash decides, so a touched but unmodified file is
+    not re-extracted. Returns the updated manifest entries for every current
+    file, the entries that need extraction and the relative paths that were
+    deleted from disk.
+    """
+    current = {}
+    changed = []
+    for catalog_entry in entries:
+        entry = {"size": catalog_entry.size, "mtime_ns": catalog_entry.mtime_ns}
+        previous = manifest.get(catalog_entry.path)
+        if previous and previous["size"] == entry["size"] and previous["mtime_ns"] == entry["mtime_ns"]:
+            entry["sha256"] = previous["sha256"]
+        else:
+            entry["sha256"] = file_digest(catalog_entry.file_path)
+            if not previous or previous["sha256"] != entry["sha256"]:
+                changed.append(catalog_entry)
+        current[catalog_entry.path] = entry
+
+    deleted = set(manifest) - set(current)
+    return current, changed, deleted
@@ -0,0 +1,62 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional
+
+PARSE_CACHE_PATH = "data/cache/parse_cache.sqlite"
+
+def text_hash(text: str) -> str:
+    """Return the SHA-256 hex digest of a text."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def parse_cache_key(text: str, prompt_version: str, model: str, schema_version: str) -> str:
+    """Build the cache key of a parse from everything that determines its result."""
+    return text_hash("\x1f".join([text_hash(text), prompt_version, model, schema_version]))
+
+class ParseCache:
+    """Disk-backed cache of structured CV parses, stored in SQLite.
+
+    Entries are keyed by ``parse_cache_key``, so changing the prompt, the model
+    or the ``ResponseFormatter`` schema simply stops matching the old entries
+    while everything else stays valid. The connection is shared between
+    threads behind a lock.
+    """
+
+    def __init__(self, path: str = PARSE_CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS parses ("
+            "key TEXT PRIMARY KEY, text_hash TEXT, prompt_version TEXT, model TEXT, "
+            "schema_version TEXT, result TEXT NOT NULL, created_at REAL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM parses WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, result: dict, text: str, prompt_version: str, model: str, schema_version: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO parses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, text_hash(text), prompt_version, model, schema_version, json.dumps(result), time.time()),
+            )
+            self._conn.commit()
+
+    def prune(self, prompt_version: str, model: str, schema_version: str) -> int:
+        """Delete entries made with another prompt, model or schema. Returns the number removed."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM parses WHERE NOT (prompt_version = ? AND model = ? AND schema_version = ?)",
+                (prompt_version, model, schema_version),
+            )
+            self._conn.commit()
+        return cursor.rowcount
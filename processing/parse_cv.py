@@ -1,15 +1,37 @@
 import os
 import json
 import logging
-import pandas as pd
 import pprint
-from typing import Optional
-from langchain_openai import ChatOpenAI
+import re
+import threading
+from enum import Enum
+from functools import lru_cache
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterable, Iterator, List, Optional, Tuple, Type, get_args
+from pydantic import BaseModel
 from langchain.prompts import ChatPromptTemplate
 from langchain_core.messages import HumanMessage, SystemMessage
-from config.config import OPENAI_API_KEY
+from config import config
 from config.logging_config import setup_logging 
 from processing.models_cv import ResponseFormatter
+from processing.dedup import load_clusters, fan_out
+from processing.corpus import read_corpus
+from processing.parse_cache import ParseCache, parse_cache_key, text_hash
+from processing.rule_fields import extract_rule_fields, response_model_without, merge_rule_fields, estimate_tokens_saved
+
+MODEL_NAME = "gpt-4o"
+PROMPT_MODE = "compact"  # "compact" builds the key list from ResponseFormatter, "full" uses the original prompt
+MAX_CV_CHARS = 12000  # Compact mode trims longer CVs section by section
+RULE_FIELDS = True  # Fill email, phone and LinkedIn with regexes and leave them out of the LLM request
+
+# Short lines that look like CV section headings, e.g. "EXPERIENCE" or "Education:"
+SECTION_HEADING = re.compile(
+    r"^\s*(?:(?-i:[A-Z][A-Z &/]{2,40})|(?:professional |work )?(?:summary|profile|objective|experience|employment|education|"
+    r"skills|projects|certifications?|publications|languages|awards|honors|volunteer(?:ing)?|references|interests)"
+    r"(?: (?:&|and) \w+)?)\s*:?\s*$",
+    re.IGNORECASE,
+)
 
 def create_extraction_prompt_cv(cv_text: str) -> ChatPromptTemplate:
     system_message = SystemMessage(
@@ -138,36 +160,194 @@ def create_extraction_prompt_cv(cv_text: str) -> ChatPromptTemplate:
 
     return ChatPromptTemplate.from_messages([system_message, user_message])
 
+def compact_schema_description(model: Type[BaseModel] = ResponseFormatter) -> str:
+    """List the keys of a response model, spelling out the allowed values of enum fields."""
+    lines = []
+    for name, field in model.model_fields.items():
+        enums = [arg for arg in get_args(field.annotation) if isinstance(arg, type) and issubclass(arg, Enum)]
+        if enums:
+            lines.append(f"{name}: {' | '.join(member.value for member in enums[0])}")
+        else:
+            lines.append(name)
+    return "\n".join(lines)
+
+def trim_cv_text(cv_text: str, max_chars: Optional[int]) -> str:
+    """Shorten a CV to ``max_chars`` while keeping every section.
+
+    The text is split at heading lines and the budget is shared out so short
+    sections (contact details, skills) stay intact and only the longest
+    sections are cut.
+    """
+    if not max_chars or len(cv_text) <= max_chars:
+        return cv_text
+
+    sections = []
+    current = []
+    for line in cv_text.splitlines():
+        if current and SECTION_HEADING.match(line):
+            sections.append("\n".join(current))
+            current = []
+        current.append(line)
+    sections.append("\n".join(current))
+
+    budgets = [0] * len(sections)
+    remaining = max_chars
+    by_length = sorted(range(len(sections)), key=lambda i: len(sections[i]))
+    for position, index in enumerate(by_length):
+        share = remaining // (len(sections) - position)
+        budgets[index] = min(len(sections[index]), share)
+        remaining -= budgets[index]
+
+    return "\n".join(section if budgets[i] >= len(section) else section[:budgets[i]].rstrip() + " ..."
+                     for i, section in enumerate(sections))
+
+def create_compact_extraction_prompt_cv(cv_text: str, model: Type[BaseModel] = ResponseFormatter) -> ChatPromptTemplate:
+    """Short extraction prompt whose key list is generated from the response model.
+
+    The structured-output call already sends the full JSON schema, so the
+    prompt only names the keys and keeps the extraction rules.
+    """
+    system_message = SystemMessage(
+        content=(
+            "You are a CV parsing assistant. Extract structured information from the CV into the given schema.\n"
+            "Rules:\n"
+            "- Use null for anything the CV does not state; never invent values.\n"
+            "- Put data in the field that matches its context (a job title is not a project title).\n"
+            "- Values are strings; join several entries of one field with commas.\n"
+            "- Dates are YYYY-MM-DD; \"present\", \"current\" or \"now\" becomes 9999-12-31.\n"
+            "- Infer work_experience_industry from the work experience if not stated.\n"
+            "- Use the listed enum values exactly.\n"
+            "- work_experience_seniority from total years of experience (today is 2025-02-27): "
+            "under 3 junior, 3 to 6 mid, over 6 senior.\n"
+            "Keys:\n"
+            f"{compact_schema_description(model)}"
+        )
+    )
+    user_message = HumanMessage(content=f"CV TEXT:\n{cv_text}")
+    return ChatPromptTemplate.from_messages([system_message, user_message])
+
+def build_extraction_prompt(cv_text: str, prompt_mode: str = PROMPT_MODE, max_cv_chars: Optional[int] = MAX_CV_CHARS,
+                            model: Type[BaseModel] = ResponseFormatter) -> ChatPromptTemplate:
+    """Build the extraction prompt for ``prompt_mode`` (``"compact"`` or ``"full"``).
 
-def parse_cv(raw_text: str, filename: str) -> Optional[ResponseFormatter]:
-    """Parse CV text using LangChain and return structured data"""
+    Only the compact prompt lists the keys of ``model``; the full prompt is
+    fixed text.
+    """
+    if prompt_mode == "compact":
+        return create_compact_extraction_prompt_cv(trim_cv_text(cv_text, max_cv_chars), model)
+    if prompt_mode == "full":
+        return create_extraction_prompt_cv(cv_text)
+    raise ValueError(f"Unknown prompt mode: {prompt_mode}")
+
+class TokenUsage:
+    """Thread-safe record of the tokens each parsed document cost."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = []
+
+    def record(self, filename: str, prompt_mode: str, input_tokens: int, output_tokens: int,
+               rule_fields: int = 0, tokens_saved: int = 0):
+        with self._lock:
+            self._records.append({"filename": filename, "prompt_mode": prompt_mode,
+                                  "input_tokens": input_tokens, "output_tokens": output_tokens,
+                                  "rule_fields": rule_fields, "tokens_saved": tokens_saved})
+
+    def drain(self) -> List[dict]:
+        """Return the records collected so far and start a new tally."""
+        with self._lock:
+            records, self._records = self._records, []
+        return records
+
+token_usage = TokenUsage()
+
+@lru_cache(maxsize=None)
+def get_structured_model(schema: Type[BaseModel] = ResponseFormatter):
+    """Build the structured-output chat model for a schema once and share it between threads."""
+    # Imported here so importing this module does not load the OpenAI SDK
+    from langchain_openai import ChatOpenAI
+    model = ChatOpenAI(
+        temperature=0,
+        model=MODEL_NAME,
+        openai_api_key=config.OPENAI_API_KEY
+    )
+    # The raw message carries the token usage of the call
+    return model.with_structured_output(schema, include_raw=True)
+
+@lru_cache(maxsize=1)
+def get_parse_cache() -> ParseCache:
+    return ParseCache()
+
+@lru_cache(maxsize=None)
+def prompt_version(prompt_mode: str = PROMPT_MODE, max_cv_chars: Optional[int] = MAX_CV_CHARS,
+                   rule_fields: bool = RULE_FIELDS) -> str:
+    """Fingerprint of the extraction prompt, taken with an empty CV text."""
+    messages = build_extraction_prompt("", prompt_mode, max_cv_chars).format_messages()
+    return text_hash("\n".join(message.content for message in messages)
+                     + f"\n{prompt_mode}:{max_cv_chars}:{'rules' if rule_fields else 'llm'}")[:16]
+
+@lru_cache(maxsize=1)
+def schema_version() -> str:
+    """Fingerprint of the ``ResponseFormatter`` JSON schema."""
+    return text_hash(json.dumps(ResponseFormatter.model_json_schema(), sort_keys=True))[:16]
+
+def parse_cv(raw_text: str, filename: str, use_cache: bool = True, prompt_mode: str = PROMPT_MODE,
+             max_cv_chars: Optional[int] = MAX_CV_CHARS, use_rule_fields: bool = RULE_FIELDS) -> Optional[ResponseFormatter]:
+    """Parse CV text using LangChain and return structured data
+
+    Results are cached on disk by text, prompt, model and schema, so
+    re-runs and identical documents skip the LLM call. ``prompt_mode``
+    selects the compact or the full prompt; in compact mode CVs longer than
+    ``max_cv_chars`` are trimmed section by section. With ``use_rule_fields``
+    email, phone number and LinkedIn URL are taken from the text with
+    regexes and the LLM is only asked for the remaining fields.
+    """
     try:
         logging.info(f"Starting parsing for {filename}")
-        prompt = create_extraction_prompt_cv(raw_text)
+        # Add document identifier without .pdf extension
+        document_id = os.path.splitext(filename)[0]  # Strip .pdf from filename
+
+        if use_cache:
+            cache = get_parse_cache()
+            version = prompt_version(prompt_mode, max_cv_chars, use_rule_fields)
+            cache_key = parse_cache_key(raw_text, version, MODEL_NAME, schema_version())
+            cached = cache.get(cache_key)
+            if cached is not None:
+                logging.info(f"Using cached parse for {filename}")
+                return dict(cached, document_id=document_id)
+
+        rule_fields = extract_rule_fields(raw_text) if use_rule_fields else {}
+        schema = response_model_without(frozenset(rule_fields))
+        prompt = build_extraction_prompt(raw_text, prompt_mode, max_cv_chars, schema)
 
         prompt = prompt.format_messages()
         
         # Call LangChain API using invoke method
         logging.debug(f"Sending request to LangChain for {filename}")
-        model = ChatOpenAI(
-            temperature=0,
-            model="gpt-4o",
-            openai_api_key=OPENAI_API_KEY
-        )
+        result = get_structured_model(schema).invoke(prompt)
 
-        model_with_structure = model.with_structured_output(ResponseFormatter)
+        usage = getattr(result["raw"], "usage_metadata", None) or {}
+        input_tokens = usage.get("input_tokens", 0)
+        output_tokens = usage.get("output_tokens", 0)
+        tokens_saved = estimate_tokens_saved(rule_fields)
+        token_usage.record(filename, prompt_mode, input_tokens, output_tokens, len(rule_fields), tokens_saved)
+        logging.info(f"Token usage for {filename}: {input_tokens} input, {output_tokens} output ({prompt_mode} prompt); "
+                     f"{len(rule_fields)} fields filled by rules saved ~{tokens_saved} tokens")
 
-        response = model_with_structure.invoke(prompt)
+        if result["parsing_error"] is not None:
+            logging.error(f"Structured output error for {filename}: {result['parsing_error']}")
+            return None
+        response = result["parsed"]
 
         pprint.pprint(response)
         
         # Extract JSON from response
         try:
             json_str = response.json()
-            parsed_data = json.loads(json_str)  # Parse the JSON string
+            parsed_data = merge_rule_fields(json.loads(json_str), rule_fields)  # Parse the JSON string
+            if use_cache:
+                cache.put(cache_key, parsed_data, raw_text, version, MODEL_NAME, schema_version())
             
-            # Add document identifier without .pdf extension
-            document_id = os.path.splitext(filename)[0]  # Strip .pdf from filename
             parsed_data['document_id'] = document_id  # Add the document identifier
             
             print(parsed_data)
@@ -181,66 +361,178 @@ def parse_cv(raw_text: str, filename: str) -> Optional[ResponseFormatter]:
     except Exception as e:
         logging.error(f"Error during CV parsing for {filename}: {e}")
         return None
+
+def parse_cvs_concurrently(jobs: Iterable[Tuple[str, str]], max_concurrency: int = 1,
+                           **parse_options) -> Iterator[Tuple[Tuple[str, str], Optional[dict]]]:
+    """Parse ``(filename, text)`` jobs with at most ``max_concurrency`` requests in flight.
+
+    Results are yielded as soon as each request completes, so callers can save
+    them immediately; the order therefore follows completion, not input.
+    ``parse_options`` are passed on to ``parse_cv``.
+    """
+    jobs = iter(jobs)
+    if max_concurrency <= 1:
+        for job in jobs:
+            yield job, parse_cv(job[1], job[0], **parse_options)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        in_flight = {executor.submit(parse_cv, job[1], job[0], **parse_options): job
+                     for job in islice(jobs, max_concurrency)}
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = in_flight.pop(future)
+                next_job = next(jobs, None)
+                if next_job is not None:
+                    in_flight[executor.submit(parse_cv, next_job[1], next_job[0], **parse_options)] = next_job
+                yield job, future.result()
     
-def process_cvs(csv_path: str, output_dir: str, batch_size: int = 10):
-    """Process all CVs from CSV and save parsed results"""
+def in_shard(filename: str, shard_index: int, shard_count: int) -> bool:
+    """Assign a document to a shard by a stable hash of its filename."""
+    return int(text_hash(filename)[:8], 16) % shard_count == shard_index
+
+def load_checkpoint(checkpoint_path: str, corpus_signature: dict) -> Optional[dict]:
+    """Return an unfinished checkpoint written for the same corpus, if any."""
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, 'r') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("completed") or checkpoint.get("corpus") != corpus_signature:
+        return None
+    return checkpoint
+
+def save_checkpoint(checkpoint_path: str, checkpoint: dict):
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, checkpoint_path)
+
+def process_cvs(corpus_path: str, output_dir: str, batch_size: int = 10, clusters_path: Optional[str] = None,
+                max_concurrency: int = 1, prompt_mode: str = PROMPT_MODE, full_corpus: bool = False,
+                shard_index: int = 0, shard_count: int = 1):
+    """Process all CVs from the extracted corpus and save parsed results
+
+    When ``clusters_path`` points to near-duplicate clusters, only the
+    representative of each cluster is sent to the LLM and its result is
+    copied to every member's ``document_id``. Up to ``max_concurrency``
+    CVs are parsed at the same time and each result is written as soon as
+    it arrives. Per-document token counts are appended to
+    ``<output_dir>/token_usage.jsonl``.
+
+    Without ``full_corpus`` only the first batch is processed. With it every
+    batch is processed and a checkpoint is written after each one, so a
+    restarted run continues with the next batch. ``shard_index`` and
+    ``shard_count`` split the corpus by filename hash between processes or
+    machines that share ``output_dir``; each shard keeps its own checkpoint.
+    """
     try:
         # Setup logging
         setup_logging('cv_parsing')
         logging.info(f"Starting CV processing with batch size {batch_size}")
         
-        # Read CSV with raw CV text
-        df = pd.read_csv(csv_path)
-        logging.info(f"Loaded {len(df)} CVs from {csv_path}")
+        # Only the columns needed for parsing are read from the corpus
+        df = read_corpus(corpus_path, columns=["filename", "preprocessed_text"])
+        logging.info(f"Loaded {len(df)} CVs from {corpus_path}")
+
+        if shard_count > 1:
+            df = df[df["filename"].map(lambda filename: in_shard(filename, shard_index, shard_count))]
+            logging.info(f"Shard {shard_index + 1}/{shard_count} holds {len(df)} CVs")
         
         # Create output directory
         os.makedirs(output_dir, exist_ok=True)
+
+        clusters = load_clusters(clusters_path)
+        duplicate_of = {member: representative for representative, members in clusters.items() for member in members}
         
         # Process CVs in batches
-        successful_parses = 0
-        failed_parses = 0
-        skipped_files = 0
+        stats = {"successful": 0, "failed": 0, "skipped": 0, "deduplicated": 0}
+        batch_count = (len(df) + batch_size - 1) // batch_size if full_corpus else min(1, len(df))
+        first_batch = 0
 
-        # Process only one batch of CVs
-        logging.info(f"Processing batch 1/1")
-        batch = df.iloc[0:batch_size]  # Get the first batch
-        
-        #for i in range(0, len(df), batch_size):
-        #    batch = df.iloc[i:i + batch_size]
-        #    logging.info(f"Processing batch {i//batch_size + 1}/{(len(df) + batch_size - 1) // batch_size}")
-            
-        for _, row in batch.iterrows():
-            output_file = os.path.join(output_dir, f"{os.path.splitext(row['filename'])[0]}.json")
-            
-            # Skip if already processed
-            if os.path.exists(output_file):
-                logging.info(f"Skipping {row['filename']} - already processed")
-                skipped_files += 1
-                continue
-            
-            # Parse CV
-            parsed_data = parse_cv(row['preprocessed_text'], row['filename'])
-            if parsed_data:
-                # Save to JSON file
-                try:
-                    with open(output_file, 'w') as f:
-                        json.dump(parsed_data, f, indent=2)
-                    logging.info(f"Successfully saved {row['filename']}")
-                    successful_parses += 1
-                except Exception as e:
-                    logging.error(f"Error saving {row['filename']}: {e}")
-                    failed_parses += 1
-            else:
-                failed_parses += 1
+        checkpoint_path = os.path.join(output_dir, f".checkpoint_shard{shard_index}of{shard_count}.ckpt")
+        corpus_signature = {"path": corpus_path, "rows": len(df), "mtime_ns": os.stat(corpus_path).st_mtime_ns,
+                            "batch_size": batch_size}
+        checkpoint = load_checkpoint(checkpoint_path, corpus_signature) if full_corpus else None
+        if checkpoint:
+            first_batch = checkpoint["next_batch"]
+            stats = checkpoint["stats"]
+            logging.info(f"Resuming from checkpoint at batch {first_batch + 1}/{batch_count}")
+
+        for batch_number in range(first_batch, batch_count):
+            batch = df.iloc[batch_number * batch_size:(batch_number + 1) * batch_size]
+            logging.info(f"Processing batch {batch_number + 1}/{batch_count}")
+            _process_batch(batch, output_dir, clusters, duplicate_of, stats, max_concurrency, prompt_mode)
+
+            if full_corpus:
+                save_checkpoint(checkpoint_path, {"corpus": corpus_signature, "next_batch": batch_number + 1,
+                                                  "stats": stats, "completed": batch_number + 1 == batch_count})
         
         # Log summary statistics
         logging.info("Processing completed!")
-        logging.info(f"Successfully parsed: {successful_parses}")
-        logging.info(f"Failed to parse: {failed_parses}")
-        logging.info(f"Skipped files: {skipped_files}")
+        logging.info(f"Successfully parsed: {stats['successful']}")
+        logging.info(f"Failed to parse: {stats['failed']}")
+        logging.info(f"Skipped files: {stats['skipped']}")
+        logging.info(f"Near duplicates reusing a representative's parse: {stats['deduplicated']}")
+
+        usage_records = token_usage.drain()
+        if usage_records:
+            with open(os.path.join(output_dir, "token_usage.jsonl"), 'a') as f:
+                for record in usage_records:
+                    f.write(json.dumps(record) + "\n")
+            input_tokens = sum(record["input_tokens"] for record in usage_records)
+            output_tokens = sum(record["output_tokens"] for record in usage_records)
+            logging.info(f"Tokens used ({prompt_mode} prompt): {input_tokens} input, {output_tokens} output, "
+                         f"{input_tokens / len(usage_records):.0f} input per document")
+            rule_fields = sum(record["rule_fields"] for record in usage_records)
+            tokens_saved = sum(record["tokens_saved"] for record in usage_records)
+            logging.info(f"Rule-based fields: {rule_fields} filled without the LLM, ~{tokens_saved} tokens saved")
         
     except Exception as e:
         logging.error(f"Error during batch processing: {e}")
         raise
 
 
+
+def _process_batch(batch, output_dir: str, clusters: dict, duplicate_of: dict, stats: dict,
+                   max_concurrency: int, prompt_mode: str):
+    """Parse one batch of corpus rows and update ``stats`` in place."""
+    jobs = []
+    for _, row in batch.iterrows():
+        output_file = os.path.join(output_dir, f"{os.path.splitext(row['filename'])[0]}.json")
+
+        # Near duplicates receive their representative's parse
+        if row['filename'] in duplicate_of:
+            logging.info(f"Skipping {row['filename']} - near duplicate of {duplicate_of[row['filename']]}")
+            stats["deduplicated"] += 1
+            continue
+        
+        # Skip if already processed
+        if os.path.exists(output_file):
+            logging.info(f"Skipping {row['filename']} - already processed")
+            stats["skipped"] += 1
+            if row['filename'] in clusters:
+                with open(output_file, 'r') as f:
+                    fan_out(json.load(f), clusters[row['filename']], output_dir)
+            continue
+
+        jobs.append((row['filename'], row['preprocessed_text']))
+        
+    # Parse CVs, saving each one as soon as its response arrives
+    for (filename, _), parsed_data in parse_cvs_concurrently(jobs, max_concurrency, prompt_mode=prompt_mode):
+        output_file = os.path.join(output_dir, f"{os.path.splitext(filename)[0]}.json")
+        if parsed_data:
+            # Save to JSON file
+            try:
+                with open(output_file, 'w') as f:
+                    json.dump(parsed_data, f, indent=2)
+                logging.info(f"Successfully saved {filename}")
+                stats["successful"] += 1
+                if filename in clusters:
+                    copies = fan_out(parsed_data, clusters[filename], output_dir)
+                    logging.info(f"Copied parse of {filename} to {copies} near duplicates")
+            except Exception as e:
+                logging.error(f"Error saving {filename}: {e}")
+                stats["failed"] += 1
+        else:
+            stats["failed"] += 1
@@ -0,0 +1,90 @@
+import os
+import json
+import numpy as np
+from typing import Dict, List, Optional
+
+CALIBRATION_PERCENTILE = 99.9  # Larger components are clipped to the int8 range
+
+def calibrate(vectors: np.ndarray, percentile: float = CALIBRATION_PERCENTILE) -> float:
+    """Scale that maps the ``percentile`` of absolute component values to 127."""
+    limit = float(np.percentile(np.abs(np.asarray(vectors, dtype=np.float32)), percentile))
+    return (limit or 1.0) / 127.0
+
+def quantize(vectors, scale: float) -> np.ndarray:
+    """Symmetric int8 quantization: ``round(v / scale)`` clipped to [-127, 127]."""
+    return np.clip(np.rint(np.asarray(vectors, dtype=np.float32) / scale), -127, 127).astype(np.int8)
+
+def dequantize(vectors: np.ndarray, scale: float) -> np.ndarray:
+    return vectors.astype(np.float32) * scale
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def recall_at_k(vectors: np.ndarray, scale: float, queries: int = 200, k: int = 10, seed: int = 1) -> float:
+    """Recall@k of cosine search over int8 vectors against exact float32 search.
+
+    Stored vectors are used as queries, quantized like query vectors are,
+    and each query's own row is excluded from its results.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if len(vectors) <= k:
+        return 1.0
+    rng = np.random.RandomState(seed)
+    query_rows = rng.choice(len(vectors), size=min(queries, len(vectors)), replace=False)
+    exact = _normalize(vectors)
+    approximate = _normalize(quantize(vectors, scale).astype(np.float32))
+
+    hits = 0
+    for row in query_rows:
+        exact_scores = exact @ exact[row]
+        approximate_scores = approximate @ approximate[row]
+        exact_scores[row] = approximate_scores[row] = -np.inf
+        exact_top = set(np.argpartition(-exact_scores, k)[:k])
+        approximate_top = set(np.argpartition(-approximate_scores, k)[:k])
+        hits += len(exact_top & approximate_top)
+    return hits / (len(query_rows) * k)
+
+def quantization_report(vector_dir: str, fields: Optional[List[str]] = None, sample: int = 20000,
+                        queries: int = 200, k: int = 10) -> List[Dict]:
+    """Compare float and int8 storage for each field of a float vector store.
+
+    For every field, reports the calibrated scale, recall@k of int8 search
+    against exact float32 search on up to ``sample`` vectors, and raw vector
+    memory in the store's float dtype (``<dtype>_mb``) and in int8 (HNSW graph overhead is the same for both and
+    not included). The report is written to ``<vector_dir>/quantization_report.json``.
+    """
+    from processing.vector_store import VectorStore
+    store = VectorStore(vector_dir)
+    rows = []
+    for field in fields or store.fields():
+        if store.is_quantized(field):
+            continue
+        _, vectors = store.load(field)
+        if not len(vectors):
+            continue
+        vectors = np.asarray(vectors[:sample], dtype=np.float32)
+        scale = calibrate(vectors)
+        count = len(store.load(field)[0])
+        rows.append({
+            "field": field,
+            "vectors": count,
+            "scale": scale,
+            f"recall@{k}": round(recall_at_k(vectors, scale, queries, k), 4),
+            f"{store.dtype.name}_mb": round(count * store.dimensions * store.dtype.itemsize / 2**20, 2),
+            "int8_mb": round(count * store.dimensions / 2**20, 2),
+        })
+
+    with open(os.path.join(vector_dir, "quantization_report.json"), 'w') as f:
+        json.dump(rows, f, indent=2)
+    for row in rows:
+        print(f"{row['field']:<45} recall@{k} {row[f'recall@{k}']:.3f}  "
+              f"{row[f'{store.dtype.name}_mb']:>9.2f} MB {store.dtype.name} -> {row['int8_mb']:>8.2f} MB int8")
+    return rows
+
+if __name__ == "__main__":
+    import sys
+    # python -m processing.quantization data/parsed_data_embeddings/cv [data/parsed_data_embeddings/profile ...]
+    for embeddings_dir in sys.argv[1:] or ["data/parsed_data_embeddings/cv", "data/parsed_data_embeddings/profile"]:
+        print(f"\n{embeddings_dir}")
+        quantization_report(os.path.join(embeddings_dir, "vectors"))
@@ -0,0 +1,103 @@
+import re
+import json
+import logging
+from functools import lru_cache
+from typing import Dict, FrozenSet, Optional, Type
+from pydantic import BaseModel, create_model
+from processing.models_cv import ResponseFormatter
+
+EMAIL_PATTERN = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}")
+LINKEDIN_PATTERN = re.compile(r"(?:https?://)?(?:[a-z]{2,3}\.)?linkedin\.com/(?:in|pub)/[A-Za-z0-9_%-]+/?", re.IGNORECASE)
+# Runs of digit groups joined by single spaces, dots or hyphens, optionally with "+" and an (area code)
+PHONE_PATTERN = re.compile(r"(?<![\w+])\+?\(?\d+\)?(?:[ .-]\(?\d+\)?)*(?!\w)")
+YEAR_PATTERN = re.compile(r"(?:19|20)\d{2}")
+MAX_PHONE_GROUPS = 4
+
+def extract_email(text: str) -> Optional[str]:
+    match = EMAIL_PATTERN.search(text)
+    return match.group(0).rstrip(".") if match else None
+
+def extract_linkedin(text: str) -> Optional[str]:
+    match = LINKEDIN_PATTERN.search(text)
+    return match.group(0).rstrip("/") if match else None
+
+def extract_phone_number(text: str) -> Optional[str]:
+    """First clearly formatted phone number: a ``+``/``00`` country prefix or a ``0`` trunk
+    digit, at most four digit groups and 10 to 15 digits.
+
+    A trailing year (``0300 1234567 2019``) is cut off. Anything less clear,
+    such as year lists, ranges or bare IDs, is left to the LLM.
+    """
+    for match in PHONE_PATTERN.finditer(text):
+        candidate = match.group(0)
+        groups = list(re.finditer(r"\d+", candidate))
+        if len(groups) > 1 and YEAR_PATTERN.fullmatch(groups[-1].group(0)) \
+                and sum(len(group.group(0)) for group in groups[:-1]) >= 10:
+            candidate = candidate[:groups[-1].start()].rstrip(" .-(")
+            groups = groups[:-1]
+        digits = "".join(group.group(0) for group in groups)
+        if (candidate.startswith("+") or digits.startswith("0")) and len(groups) <= MAX_PHONE_GROUPS \
+                and 10 <= len(digits) <= 15:
+            return candidate
+    return None
+
+# ResponseFormatter fields that are filled locally instead of by the LLM
+RULE_EXTRACTORS = {
+    "contact_information_email": extract_email,
+    "contact_information_phone_number": extract_phone_number,
+    "contact_information_linkedin": extract_linkedin,
+}
+
+def extract_rule_fields(text: str) -> Dict[str, str]:
+    """Fill the deterministic ``ResponseFormatter`` fields that can be found in a CV text.
+
+    Fields whose pattern does not match are left out, so the LLM is still
+    asked for them.
+    """
+    fields = {}
+    for field, extractor in RULE_EXTRACTORS.items():
+        value = extractor(text)
+        if value:
+            fields[field] = value
+    return fields
+
+@lru_cache(maxsize=None)
+def response_model_without(fields: FrozenSet[str]) -> Type[BaseModel]:
+    """``ResponseFormatter`` minus ``fields``, for asking the LLM only for the rest."""
+    if not fields:
+        return ResponseFormatter
+    remaining = {name: (field.annotation, field) for name, field in ResponseFormatter.model_fields.items()
+                 if name not in fields}
+    # Keeping the name keeps the function/tool name the model is called with
+    return create_model("ResponseFormatter", **remaining)
+
+def merge_rule_fields(parsed_data: dict, rule_fields: Dict[str, str]) -> dict:
+    """Combine an LLM parse of the remaining fields with the locally extracted ones."""
+    merged = ResponseFormatter.model_validate({**parsed_data, **rule_fields})
+    return json.loads(merged.model_dump_json())
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logging.warning(f"tiktoken unavailable, estimating tokens from characters: {e}")
+        return None
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    return len(encoding.encode(text)) if encoding else (len(text) + 3) // 4
+
+def estimate_tokens_saved(rule_fields: Dict[str, str]) -> int:
+    """Estimate the tokens a request saves by not asking the LLM for ``rule_fields``.
+
+    Counts the schema properties and prompt keys no longer sent plus the
+    ``"key": "value"`` pairs the model no longer has to generate.
+    """
+    if not rule_fields:
+        return 0
+    properties = ResponseFormatter.model_json_schema()["properties"]
+    sent = json.dumps({field: properties[field] for field in rule_fields}) + "\n".join(rule_fields)
+    generated = json.dumps(rule_fields)
+    return count_tokens(sent) + count_tokens(generated)
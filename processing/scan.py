@@ -0,0 +1,110 @@
+import os
+import json
+from dataclasses import dataclass, asdict
+from typing import Dict, Iterator, List, Optional
+
+CATALOG_DIR = "data/catalog"
+
+@dataclass
+class CatalogEntry:
+    """One file found under a scanned directory tree."""
+    path: str
+    filename: str
+    base_name: str
+    extension: str
+    size: int
+    mtime_ns: int
+    mime_type: Optional[str] = None
+    file_path: str = ""
+
+class Catalog:
+    """In-memory listing of a directory tree, cached on disk between runs.
+
+    MIME types are not sniffed by the scan itself; they are filled in by the
+    extraction stage for the files it actually opens and carried over to the
+    next run as long as the file's size and mtime are unchanged.
+    """
+
+    def __init__(self, root: str, entries: List[CatalogEntry], cache_path: Optional[str] = None):
+        self.root = root
+        self.entries = entries
+        self.cache_path = cache_path
+        self._by_path = {entry.path: entry for entry in entries}
+
+    def __iter__(self) -> Iterator[CatalogEntry]:
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, path: str) -> Optional[CatalogEntry]:
+        return self._by_path.get(path)
+
+    def save(self):
+        if not self.cache_path:
+            return
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump([{key: value for key, value in asdict(entry).items() if key != "file_path"}
+                       for entry in self.entries], f)
+        os.replace(tmp_path, self.cache_path)
+
+_catalogs: Dict[str, Catalog] = {}
+
+def catalog_cache_path(root: str) -> str:
+    """Return the on-disk cache location for the catalog of ``root``."""
+    name = os.path.normpath(root).strip(os.sep).replace(os.sep, "_") or "root"
+    return os.path.join(CATALOG_DIR, f"{name}.json")
+
+def _walk(root: str) -> Iterator[os.DirEntry]:
+    """Yield every regular file below ``root`` using a single scandir pass."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    yield entry
+
+def scan_directory(root: str, refresh: bool = False) -> Catalog:
+    """Walk ``root`` once and return its catalog.
+
+    The catalog is memoized per process so every stage that needs the same
+    tree shares one walk; pass ``refresh=True`` to rescan.
+    """
+    key = os.path.abspath(root)
+    if not refresh and key in _catalogs:
+        return _catalogs[key]
+
+    cache_path = catalog_cache_path(root)
+    cached = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r') as f:
+            cached = {item["path"]: item for item in json.load(f)}
+
+    entries = []
+    for dir_entry in _walk(root):
+        stat = dir_entry.stat()
+        relative_path = os.path.relpath(dir_entry.path, root)
+        filename = dir_entry.name
+        previous = cached.get(relative_path)
+        mime_type = None
+        if previous and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+            mime_type = previous.get("mime_type")
+        entries.append(CatalogEntry(
+            path=relative_path,
+            filename=filename,
+            base_name=filename.rsplit('-', 1)[0],
+            extension=filename.lower().split('.')[-1],
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            mime_type=mime_type,
+            file_path=dir_entry.path,
+        ))
+
+    catalog = Catalog(root, entries, cache_path)
+    _catalogs[key] = catalog
+    return catalog
@@ -0,0 +1,168 @@
+import os
+import json
+import logging
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from processing.quantization import calibrate, quantize
+
+VECTOR_DTYPE = "float32"  # "float16" halves the sidecar at a small precision cost
+
+def vector_dir_for(output_dir: str) -> str:
+    """Return the sidecar directory holding the vectors of a directory of JSON documents."""
+    return os.path.join(output_dir, "vectors")
+
+class VectorStore:
+    """Per-field binary vector files kept next to slim JSON documents.
+
+    Every field has ``<field>.bin``, raw rows of ``dimensions`` values, and
+    ``<field>.ids``, the ``document_id`` of each row, one per line. Rows are
+    only appended; when a document is written again its latest row wins, and
+    a removed document's ids are blanked so its rows are no longer referenced.
+    Vectors are read through ``np.memmap`` without copying.
+
+    Fields listed in ``quantized_fields`` are stored as int8. Their scale is
+    calibrated on the first vectors appended and kept in ``meta.json``, so
+    query vectors can be quantized the same way. The layout of an existing
+    store is taken from its ``meta.json``.
+    """
+
+    def __init__(self, directory: str, dimensions: Optional[int] = None, dtype: str = VECTOR_DTYPE,
+                 quantized_fields: Sequence[str] = ()):
+        self.directory = directory
+        self._meta_path = os.path.join(directory, "meta.json")
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, 'r') as f:
+                self.meta = json.load(f)
+            if quantized_fields and set(quantized_fields) != set(self.meta.get("quantized_fields", [])):
+                logging.warning(f"{directory} keeps its existing quantized fields "
+                                f"{self.meta.get('quantized_fields', [])}; write to a new directory to change them")
+        elif dimensions is None:
+            raise ValueError(f"No vector store in {directory} and no dimensions given")
+        else:
+            os.makedirs(directory, exist_ok=True)
+            self.meta = {"dimensions": dimensions, "dtype": dtype, "quantized_fields": sorted(quantized_fields),
+                         "calibration": {}}
+            self._save_meta()
+        self.dimensions = self.meta["dimensions"]
+        self.dtype = np.dtype(self.meta["dtype"])
+        self._fields = {}
+        self._repaired = set()
+
+    def _save_meta(self):
+        with open(f"{self._meta_path}.tmp", 'w') as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(f"{self._meta_path}.tmp", self._meta_path)
+
+    def is_quantized(self, field: str) -> bool:
+        return field in self.meta.get("quantized_fields", [])
+
+    @property
+    def calibration(self) -> Dict[str, float]:
+        """int8 scale of each quantized field that has vectors."""
+        return dict(self.meta.get("calibration", {}))
+
+    def _dtype(self, field: str) -> np.dtype:
+        return np.dtype(np.int8) if self.is_quantized(field) else self.dtype
+
+    def _row_bytes(self, field: str) -> int:
+        return self.dimensions * self._dtype(field).itemsize
+
+    def _paths(self, field: str) -> Tuple[str, str]:
+        base = os.path.join(self.directory, field)
+        return f"{base}.bin", f"{base}.ids"
+
+    def fields(self) -> List[str]:
+        return sorted(name[:-4] for name in os.listdir(self.directory) if name.endswith(".ids"))
+
+    def append(self, rows: Iterable[Tuple[str, Dict[str, List[float]]]]):
+        """Append ``(document_id, {field: vector})`` rows, writing each field's files once."""
+        by_field = {}
+        for document_id, vectors in rows:
+            for field, vector in vectors.items():
+                by_field.setdefault(field, ([], []))
+                by_field[field][0].append(document_id)
+                by_field[field][1].append(vector)
+
+        for field, (document_ids, vectors) in by_field.items():
+            vectors_path, ids_path = self._paths(field)
+            self._repair(field)
+            if self.is_quantized(field):
+                array = self._quantize(field, vectors)
+            else:
+                array = np.asarray(vectors, dtype=self.dtype).reshape(len(vectors), self.dimensions)
+            # Vectors go first: ids without a vector are never written
+            with open(vectors_path, 'ab') as f:
+                f.write(array.tobytes())
+            with open(ids_path, 'a') as f:
+                f.write("".join(f"{document_id}\n" for document_id in document_ids))
+            self._fields.pop(field, None)
+
+    def remove(self, document_ids: Iterable[str]):
+        """Unreference every row of the given documents in all fields."""
+        document_ids = set(document_ids)
+        if not document_ids:
+            return
+        for field in self.fields():
+            _, ids_path = self._paths(field)
+            with open(ids_path, 'r') as f:
+                lines = f.read().splitlines()
+            if document_ids.isdisjoint(lines):
+                continue
+            with open(f"{ids_path}.tmp", 'w') as f:
+                # Blank lines keep the remaining ids aligned with their rows
+                f.write("".join(f"{'' if line in document_ids else line}\n" for line in lines))
+            os.replace(f"{ids_path}.tmp", ids_path)
+            self._fields.pop(field, None)
+
+    def _quantize(self, field: str, vectors: list) -> np.ndarray:
+        # Rows read back from a quantized field are already int8 and are copied as they are
+        floats = [vector for vector in vectors if not (isinstance(vector, np.ndarray) and vector.dtype == np.int8)]
+        calibration = self.meta.setdefault("calibration", {})
+        if field not in calibration and floats:
+            calibration[field] = calibrate(np.asarray(floats, dtype=np.float32))
+            self._save_meta()
+        return np.stack([vector if isinstance(vector, np.ndarray) and vector.dtype == np.int8
+                         else quantize(vector, calibration[field]) for vector in vectors])
+
+    def _repair(self, field: str):
+        """Drop vector rows left without an id by an interrupted append."""
+        vectors_path, ids_path = self._paths(field)
+        if field in self._repaired or not os.path.exists(vectors_path):
+            self._repaired.add(field)
+            return
+        self._repaired.add(field)
+        count = 0
+        if os.path.exists(ids_path):
+            with open(ids_path, 'r') as f:
+                count = sum(1 for _ in f)
+        if os.path.getsize(vectors_path) > count * self._row_bytes(field):
+            os.truncate(vectors_path, count * self._row_bytes(field))
+
+    def load(self, field: str) -> Tuple[Dict[str, int], np.ndarray]:
+        """Return ``({document_id: row}, vectors)`` for a field; ``vectors`` is a read-only memmap.
+
+        Quantized fields come back as int8; ``dequantize`` with the field's
+        ``calibration`` scale gives approximate floats.
+        """
+        if field not in self._fields:
+            vectors_path, ids_path = self._paths(field)
+            dtype = self._dtype(field)
+            if not os.path.exists(ids_path):
+                return {}, np.empty((0, self.dimensions), dtype=dtype)
+            with open(ids_path, 'r') as f:
+                document_ids = f.read().splitlines()
+            rows = min(len(document_ids), os.path.getsize(vectors_path) // self._row_bytes(field))
+            vectors = (np.memmap(vectors_path, dtype=dtype, mode='r', shape=(rows, self.dimensions))
+                       if rows else np.empty((0, self.dimensions), dtype=dtype))
+            self._fields[field] = ({document_id: row for row, document_id in enumerate(document_ids[:rows]) if document_id},
+                                   vectors)
+        return self._fields[field]
+
+    def get(self, document_id: str) -> Dict[str, np.ndarray]:
+        """All vectors of a document, as views into the memory-mapped files."""
+        vectors = {}
+        for field in self.fields():
+            rows, array = self.load(field)
+            if document_id in rows:
+                vectors[field] = array[rows[document_id]]
+        return vectors
@@ -9,6 +9,22 @@ def vector_to_str(vector):
     """Convert a vector array to a comma-separated string"""
     return ",".join([str(val) for val in vector])
 
+def load_calibration(embeddings_dir):
+    """
+    Load the int8 scales of the quantized vector fields of an embeddings directory
+    (written by the embedding stage to <embeddings_dir>/vectors/meta.json).
+    Returns an empty dict when no field is quantized.
+    """
+    meta_path = os.path.join(embeddings_dir, "vectors", "meta.json")
+    if not os.path.exists(meta_path):
+        return {}
+    with open(meta_path, 'r') as f:
+        return json.load(f).get("calibration", {})
+
+def quantize_vector(vector, scale):
+    """Quantize a query vector to int8 values the same way stored vectors are (processing/quantization.py)"""
+    return np.clip(np.rint(np.asarray(vector, dtype=np.float32) / scale), -127, 127).astype(int).tolist()
+
 def load_job_embeddings(csv_file_path, row_index):
     """
     Load job embeddings from a CSV file for a specific row
@@ -78,13 +94,22 @@ def load_job_embeddings(csv_file_path, row_index):
         print(f"Error loading embeddings: {e}")
         return None, None, None, None, None
 
-def build_search_query(job_title_vector, skills_vector=None, desc_vector=None, location_vector=None, job_info=None):
+def build_search_query(job_title_vector, skills_vector=None, desc_vector=None, location_vector=None, job_info=None,
+                       calibration=None):
     """
     Build query parameters for searching with multiple vectors with different weights
-    and keyword search for location and seniority as filters
+    and keyword search for location and seniority as filters.
+    Vectors for fields in calibration (see load_calibration) are quantized to match BYTE vector fields.
     """
+    calibration = calibration or {}
+
+    def knn_vector_str(field, vector):
+        if field in calibration:
+            vector = quantize_vector(vector, calibration[field])
+        return vector_to_str(vector)
+
     # Convert job title vector to string (this one is mandatory)
-    job_title_vector_str = vector_to_str(job_title_vector)
+    job_title_vector_str = knn_vector_str("work_experience_job_titles_embedding", job_title_vector)
     
     # Create query parameters with job title vector
     query_params = {
@@ -103,7 +128,7 @@ def build_search_query(job_title_vector, skills_vector=None, desc_vector=None, l
     
     # Add skills vector to query if available (weight 3)
     if skills_vector:
-        skills_vector_str = vector_to_str(skills_vector)
+        skills_vector_str = knn_vector_str("skills_embedding", skills_vector)
         query_params["bq"].append(
             f"{{!knn f=skills_embedding topK=120 boost=3}}[{skills_vector_str}]"
         )
@@ -156,7 +181,7 @@ def build_search_query(job_title_vector, skills_vector=None, desc_vector=None, l
 
     # Lets add a semantic query for location for testing purposes
     if location_vector:
-        location_vector_str = vector_to_str(location_vector)
+        location_vector_str = knn_vector_str("contact_information_address_embedding", location_vector)
         query_params["bq"].append(
             f"{{!knn f=contact_information_address_embedding topK=5 boost=15}}[{location_vector_str}]"
         )
@@ -168,7 +193,7 @@ def build_search_query(job_title_vector, skills_vector=None, desc_vector=None, l
 
     # Add description vector to query if available (weight 2)
     if desc_vector:
-        desc_vector_str = vector_to_str(desc_vector)
+        desc_vector_str = knn_vector_str("work_experience_descriptions_embedding", desc_vector)
         query_params["bq"].append(
             f"{{!knn f=work_experience_descriptions_embedding topK=30 boost=2}}[{desc_vector_str}]"
         )
@@ -257,22 +282,31 @@ if __name__ == "__main__":
     job_title_vector, skills_vector, location_vector, desc_vector, job_info = load_job_embeddings(csv_path, row_index)
     
     if job_title_vector:
-        # Build query parameters
-        query_params = build_search_query(
+        # Build query parameters; each collection quantizes with its own calibration
+        cv_query_params = build_search_query(
+            job_title_vector, 
+            skills_vector, 
+            desc_vector,
+            location_vector,
+            job_info,
+            calibration=load_calibration("data/parsed_data_embeddings/cv")
+        )
+        profile_query_params = build_search_query(
             job_title_vector, 
             skills_vector, 
             desc_vector,
             location_vector,
-            job_info
+            job_info,
+            calibration=load_calibration("data/parsed_data_embeddings/profile")
         )
         
         # Search CV collection
         print("\nSearching cv_collection...")
-        cv_response = search_collection_by_vectors("cv_collection", query_params)
+        cv_response = search_collection_by_vectors("cv_collection", cv_query_params)
         
         # Search profile collection
         print("\nSearching profile_collection collection...")
-        profile_response = search_collection_by_vectors("profile_collection", query_params)
+        profile_response = search_collection_by_vectors("profile_collection", profile_query_params)
         
         # Process and display results for CV collection
         try:
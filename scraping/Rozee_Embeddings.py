@@ -1,10 +1,7 @@
-import time
 import pandas as pd
 import os
-import numpy as np
-from langchain_openai import OpenAIEmbeddings
 import logging
-from config.config import OPENAI_API_KEY
+from processing.calculate_embeddings import embed_column
 # Set up logging
 logging.basicConfig(
     level=logging.INFO,
@@ -15,34 +12,6 @@ logging.basicConfig(
     ]
 )
 
-# Initialize the OpenAI embeddings model
-print("Setting up OpenAI embeddings...")
-start_time = time.time()
-
-embeddings_model = OpenAIEmbeddings(
-    model="text-embedding-3-large", 
-    openai_api_key="OPENAI_API_KEY",
-    dimensions=1024
-)
-
-end_time = time.time()
-print(f"Setup completed in {end_time - start_time:.2f} seconds.")
-
-def embed_text_openai(text) -> list:
-    """
-    Generates embeddings for the given text using OpenAI's embedding model.
-    If the text is empty or not a string, returns a zero vector.
-    Uses the text-embedding-3-large model with 1024 dimensions.
-    """
-    if not isinstance(text, str) or not text.strip():
-        return np.zeros(1024).tolist()  # Return zero vector if text is empty or invalid
-    try:
-        embedding = embeddings_model.embed_query(text)
-        return embedding
-    except Exception as e:
-        logging.error(f"Error generating embedding for text: {text[:30]}... - {e}")
-        return np.zeros(1024).tolist()  # Return zero vector in case of error
-
 def calculate_embeddings(input_csv: str, output_csv: str):
     """
     Reads a CSV file, generates embeddings for specific fields, and saves the updated CSV.
@@ -58,13 +27,13 @@ def calculate_embeddings(input_csv: str, output_csv: str):
 
         # Generate embeddings for each field
         logging.info("Generating embeddings for job data...")
-        df["title_vector"] = df["Job Title"].apply(embed_text_openai)
+        df["title_vector"] = embed_column(df, "Job Title")
         logging.info("Job titles embedded.")
-        df["desc_vector"] = df["Job Description"].apply(embed_text_openai)
+        df["desc_vector"] = embed_column(df, "Job Description")
         logging.info("Descriptions embedded.")
-        df["location_vector"] = df["Location"].apply(embed_text_openai)
+        df["location_vector"] = embed_column(df, "Location")
         logging.info("Locations embedded.")
-        df["skills_vector"] = df["Required Skills"].apply(embed_text_openai)
+        df["skills_vector"] = embed_column(df, "Required Skills")
         logging.info("Skills embedded.")
 
         # Save the updated CSV with embeddings